@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+'''
+Times the indexing of a directory into a DirTrie.
+Not part of the extraction; used to measure changes to dir_trie.py.
+
+    benchmark-dir-trie.py index ROOT [--make-tree FILES] [--threads N]
+    benchmark-dir-trie.py filters [--counts N ...] [--paths N]
+'''
+
+import argparse
+import os
+import random
+import re
+import time
+
+from dir_trie import DirTrie, FileFilters, glob_translate
+
+
+def make_tree(root, files, fanout=100):
+    '''
+    Create a synthetic source tree of the given number of files under root:
+    fanout top-level directories, each with subdirectories of fanout files.
+    '''
+    created = 0
+    top = 0
+    while created < files:
+        for sub in range(fanout):
+            if created >= files:
+                break
+            d = os.path.join(root, 'dir{:03d}'.format(top), 'sub{:03d}'.format(sub))
+            os.makedirs(d, exist_ok=True)
+            for i in range(min(fanout, files - created)):
+                ext = '.h' if i % 2 else '.cpp'
+                open(os.path.join(d, 'file{:03d}{}'.format(i, ext)), 'w').close()
+            created += min(fanout, files - created)
+        top += 1
+
+
+def benchmark_index(args):
+    if args.make_tree:
+        start = time.perf_counter()
+        make_tree(args.root, args.make_tree)
+        print('Created {} files in {:.1f}s'.format(args.make_tree, time.perf_counter() - start))
+
+    for threads in args.threads:
+        trie = DirTrie()
+        start = time.perf_counter()
+        trie.of_dir(args.root, threads=threads)
+        indexed = time.perf_counter() - start
+        start = time.perf_counter()
+        count = len(trie.get_paths())
+        listed = time.perf_counter() - start
+        print('threads={}: indexed {} files in {:.2f}s, listed them in {:.2f}s'.format(
+            threads, count, indexed, listed))
+
+
+class RegexFileFilters:
+    '''
+    FileFilters as it was before GlobSet: every filter joined into one regular expression.
+    Kept to compare against.
+    '''
+
+    def __init__(self, root, filters):
+        root = os.path.normpath(root)
+        include = []
+        exclude = ['(?!)']
+        for line in filters.split('\n'):
+            pattern = os.path.join(root, line[8:].strip(' /\\'))
+            alternatives = include if line.startswith('include:') else exclude
+            alternatives += [glob_translate(pattern), glob_translate(pattern + '/**')]
+        if not include:
+            include = [glob_translate(root + '/**')]
+        self.include = re.compile('|'.join(include))
+        self.exclude = re.compile('|'.join(exclude))
+
+    def includes(self, path):
+        path = path.replace('\\', '/')
+        return bool(self.include.match(path)) and not bool(self.exclude.match(path))
+
+
+def make_filters(count, rng):
+    '''Filters in the style of LGTM_INDEX_FILTERS: mostly directories, some wildcards'''
+    filters = []
+    for i in range(count):
+        kind = 'include:' if i % 4 == 0 else 'exclude:'
+        top = 'dir{:03d}'.format(rng.randrange(100))
+        sub = 'sub{:03d}'.format(rng.randrange(100))
+        pattern = rng.choice([top, top + '/' + sub, top + '/' + sub + '/*.h', top + '/**/gen',
+                              top + '/sub0*', '**/' + sub + '/file00?.cpp'])
+        filters.append(kind + pattern)
+    return '\n'.join(filters)
+
+
+def benchmark_filters(args):
+    rng = random.Random(0)
+    root = '/src'
+    paths = ['{}/dir{:03d}/sub{:03d}/file{:03d}{}'.format(
+        root, rng.randrange(100), rng.randrange(100), rng.randrange(100), rng.choice(['.h', '.cpp']))
+        for _ in range(args.paths)]
+    for count in args.counts:
+        filters = make_filters(count, rng)
+        results = []
+        for implementation in (RegexFileFilters, FileFilters):
+            start = time.perf_counter()
+            matcher = implementation(root, filters)
+            built = time.perf_counter() - start
+            start = time.perf_counter()
+            included = [matcher.includes(path) for path in paths]
+            matched = time.perf_counter() - start
+            results.append(included)
+            print('{} filters, {}: built in {:.1f}ms, {:.2f}us per path, {} of {} included'.format(
+                count, implementation.__name__, built * 1000, matched * 1e6 / len(paths),
+                sum(included), len(paths)))
+        if results[0] != results[1]:
+            raise Exception('FileFilters and RegexFileFilters disagree')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for dir_trie.py')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    index = commands.add_parser('index', help='Time DirTrie.of_dir on a directory')
+    index.add_argument('root')
+    index.add_argument('--make-tree', type=int, metavar='FILES',
+                       help='First create a synthetic tree with this many files in root')
+    index.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    index.set_defaults(run=benchmark_index)
+
+    filters = commands.add_parser('filters', help='Time FileFilters.includes')
+    filters.add_argument('--counts', type=int, nargs='+', default=[10, 100, 1000])
+    filters.add_argument('--paths', type=int, default=100000)
+    filters.set_defaults(run=benchmark_filters)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
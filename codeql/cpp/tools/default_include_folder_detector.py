@@ -1,7 +1,10 @@
+import json
 import os.path
 import re
 import shlex
+import shutil
 import subprocess
+import time
 
 """
 This file contains functions to get the default include paths of a given compiler (i.e. the include
@@ -52,12 +55,16 @@ def parse_compiler_includes(output):
             split_and_normalize_paths(global_include_includes_capture))
 
 
-def get_default_include_folder_for_compiler(compiler, cpp):
+def get_default_include_folder_for_compiler(compiler, cpp, cache_file=None):
     """
     Get the normalized default include paths of the given compiler (limited to clang or gcc).
 
     :param compiler: The compiler to use
     :param cpp: Print paths for C++ (C if False)
+    :param cache_file: JSON file in which the paths are cached between runs, keyed by the path
+            and mtime of the compiler binary and the language. The compiler only lists the
+            folders that exist, and clang picks its GCC installation when run, so an entry is
+            only reused while the listed folders and their parents keep their mtimes.
     :return: A list of default include paths
 
     :note: This function returns a pair of empty lists if run on non-unix systems or if the given
@@ -65,10 +72,106 @@ def get_default_include_folder_for_compiler(compiler, cpp):
     """
     language = 'c++' if cpp else 'c'
 
+    key = compiler_cache_key(compiler, language) if cache_file is not None else None
+    cache = load_cache(cache_file) if key is not None else {}
+    entry = cache.get(key)
+    if isinstance(entry, dict) and is_current(entry):
+        local_includes, global_includes = entry['includes']
+        return local_includes, global_includes
+
     cmd = [compiler, '-x', language, '-v', '-E', '/dev/null', '-o', '/dev/null']
     try:
         r = subprocess.run(cmd, capture_output=True, check=True)
-        return parse_compiler_includes(r.stderr.decode())
+        includes = parse_compiler_includes(r.stderr.decode())
     except Exception as e:
         # If the command fails, return an empty set
         return [], []
+
+    if key is not None:
+        dir_mtimes = folder_mtimes(includes[0] + includes[1])
+        # A folder changed within the mtime resolution could change again unnoticed
+        settled = time.time_ns() - mtime_settle_ns
+        if all(mtime is None or mtime < settled for _, mtime in dir_mtimes):
+            # Reload, in case another run added to the cache meanwhile
+            cache = load_cache(cache_file)
+            cache[key] = {'includes': includes, 'dirs': dir_mtimes}
+            save_cache(cache_file, cache)
+    return includes
+
+
+# How long ago a folder must have been modified for its mtime to be trusted in the cache
+mtime_settle_ns = 2 * 10**9
+
+
+def folder_mtimes(folders):
+    """
+    The mtimes of the given folders and of their parents, as [folder, mtime] pairs with None for
+    a missing folder. A parent changes when a sibling version is installed or removed, as in
+    /usr/lib/gcc/x86_64-linux-gnu/13 next to 12.
+    """
+    result = []
+    seen = set()
+    for folder in folders:
+        for path in (folder, os.path.dirname(folder)):
+            if path in seen:
+                continue
+            seen.add(path)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                mtime = None
+            result.append([path, mtime])
+    return result
+
+
+def is_current(entry):
+    """Whether a cache entry's folders are unchanged, see folder_mtimes"""
+    try:
+        for path, mtime in entry['dirs']:
+            try:
+                current = os.stat(path).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime:
+                return False
+    except (KeyError, TypeError, ValueError):
+        return False
+    return True
+
+
+def compiler_cache_key(compiler, language):
+    """
+    The key of a compiler's default include paths for the given language in the cache, or None
+    if the compiler binary is not found.
+    """
+    path = shutil.which(compiler)
+    if path is None:
+        return None
+    path = os.path.realpath(path)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    return '{}\0{}\0{}'.format(path, mtime, language)
+
+
+def load_cache(cache_file):
+    """Load the default include paths cache, ignoring a missing or unreadable file"""
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache_file, cache):
+    """Write the default include paths cache, replacing the file atomically"""
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        tmp = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        os.replace(tmp, cache_file)
+    except OSError:
+        pass
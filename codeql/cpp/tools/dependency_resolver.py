@@ -1,3 +1,5 @@
+import os
+
 import default_include_folder_detector
 from folder_scanner import FolderScanner
 
@@ -6,26 +8,37 @@ def print_if(verbose, msg):
     if verbose:
         print(msg)
 
-def get_missing_system_includes(includes, compiler, verbose=False):
+def get_missing_system_includes(includes, compiler, verbose=False, cache_dir=None):
     """
     Get a list of missing system includes from a list of includes.
 
     :param includes: A list of includes
     :param compiler: The compiler to use
     :param verbose: Print debug messages
+    :param cache_dir: Directory in which the system directory indexes, the compiler default
+        include folders and the includes of scanned files are kept between runs
     :return: A list of missing system includes
     """
     if len(includes) == 0:
         return []
-    folder_scanner = FolderScanner(verbose=verbose)
+    if cache_dir is None:
+        include_cache = index_cache_dir = compiler_cache = None
+    else:
+        include_cache = os.path.join(cache_dir, 'includes.json')
+        index_cache_dir = os.path.join(cache_dir, 'index')
+        compiler_cache = os.path.join(cache_dir, 'compiler-includes.json')
+    folder_scanner = FolderScanner(verbose=verbose, include_cache=include_cache)
     root_dir = "/usr/include"
     print_if(verbose, f"Resolving {len(includes)} missing include files")
     # We don't know if it is C or C++ code, so we try C++
     local_standard_library_folders, global_standard_library_folders = (
-        default_include_folder_detector.get_default_include_folder_for_compiler(compiler, True))
+        default_include_folder_detector.get_default_include_folder_for_compiler(
+            compiler, True, compiler_cache))
     folder_scanner.scan_dir(root_dir, False,
-                            local_standard_library_folders + global_standard_library_folders)
+                            local_standard_library_folders + global_standard_library_folders,
+                            index_cache_dir)
     folder_scanner.compute_include_dirs_from_include_list(includes, root_dir)
+    folder_scanner.include_extractor.save_cache()
     print_if(verbose, f"Added {len(folder_scanner.include_dirs)} include folders")
     for folder in folder_scanner.include_dirs:
         print_if(verbose, f"  {folder}")
@@ -11,10 +11,122 @@ which allows fast lookups for names matching the end of filenames:
 All results are prefixed with the root
 (see set_root)
 
+A built trie can be saved to a file and memory-mapped by later runs (see save and load, and
+of_dir_cached, which reuses a saved trie while the directories it was built from are unchanged).
+
 Note that this data structure is not meant to lookup files specified using absolute paths.
 '''
+import array
+import bisect
+import hashlib
+import json
+import mmap
 import os
 import re
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+class GlobNode:
+    '''A node of a GlobSet, reached by a sequence of literal path segments'''
+
+    def __init__(self):
+        self.children = {}
+        # Whether a pattern ends at this node with no wildcard
+        self.exact = False
+        # Whether a pattern matches everything below this node (a remainder of only '**')
+        self.below = False
+        # The wildcard remainders of the patterns whose literal segments end at this node
+        self.tails = []
+
+
+class GlobSet:
+    '''
+    A set of glob patterns (see glob_translate) matching whole paths.
+    Patterns are stored in a trie of their leading literal path segments, with the remainder
+    of each pattern, from its first segment with a wildcard, kept at the node where its
+    literal segments end. The trie is compiled into a single regular expression that shares
+    every literal prefix, so a path is only tested against the remainders stored along its
+    own segments instead of against every pattern in turn.
+    '''
+
+    def __init__(self, patterns=()):
+        self.root = GlobNode()
+        self.regex = None
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern):
+        segments = os.path.normpath(pattern).replace('\\','/').split('/')
+        node = self.root
+        self.regex = None
+        for i, segment in enumerate(segments):
+            if '*' in segment or '?' in segment:
+                tail = '/'.join(segments[i:])
+                if len(tail) > 1 and tail.strip('*') == '':
+                    node.below = True
+                else:
+                    node.tails.append(tail)
+                return
+            child = node.children.get(segment)
+            if child is None:
+                child = GlobNode()
+                node.children[segment] = child
+            node = child
+        node.exact = True
+
+    @staticmethod
+    def _tails_regex(tails):
+        # Remainders starting with ** share a single leading .*, rather than each
+        # backtracking over the rest of the path
+        regexes = []
+        anywhere = []
+        for tail in tails:
+            regex = glob_regex(tail)
+            if regex.startswith('.*'):
+                anywhere.append(regex[2:])
+            else:
+                regexes.append(regex)
+        if anywhere:
+            regexes.append('.*(?:' + '|'.join(anywhere) + ')')
+        return '(?:' + '|'.join(regexes) + ')\\Z'
+
+    def _below_regex(self, node):
+        '''Alternatives for the part of a path after the node's segments and a separator'''
+        alternatives = []
+        if node.below:
+            alternatives.append('')
+        if node.tails:
+            alternatives.append(self._tails_regex(node.tails))
+        for segment, child in node.children.items():
+            alternatives.append(re.escape(segment) + self._node_regex(child))
+        return alternatives
+
+    def _node_regex(self, node):
+        '''The regular expression for the part of a path after the node's segments'''
+        alternatives = []
+        if node.exact:
+            alternatives.append('\\Z')
+        below = self._below_regex(node)
+        if below:
+            alternatives.append('/(?:' + '|'.join(below) + ')')
+        return '(?:' + '|'.join(alternatives) + ')'
+
+    def compile(self):
+        '''Compile the trie into a regular expression (done by the first match otherwise)'''
+        alternatives = self._below_regex(self.root)
+        if alternatives:
+            self.regex = re.compile('(?:' + '|'.join(alternatives) + ')', re.DOTALL)
+        else:
+            self.regex = re.compile('(?!)')
+
+    def match(self, path):
+        '''Returns True if a pattern matches the whole of path, which uses '/' separators'''
+        if self.regex is None:
+            self.compile()
+        return self.regex.match(path) is not None
+
 
 class FileFilters:
     '''
@@ -25,9 +137,11 @@ class FileFilters:
     '''
 
     def __init__(self, root, filters = None):
-        exclude = '(?!)' # Match nothing
         root = os.path.normpath(root)
-        include = None
+        self.include = GlobSet()
+        self.exclude = GlobSet()
+        # The literal start of every include pattern, up to its first wildcard
+        self.include_prefixes = []
         if filters is None:
             filters = os.environ.get('LGTM_INDEX_FILTERS','')
         for line in filters.split('\n'):
@@ -36,22 +150,22 @@ class FileFilters:
                 continue
             if line.startswith('include:'):
                 pattern = os.path.join(root, line[8:].strip(' /\\'))
-                tail = glob_translate(pattern) + '|' + glob_translate(pattern + '/**')
-                if include is None:
-                    include = tail
-                else:
-                    include = include + '|' + tail
+                self.include.add(pattern)
+                self.include.add(pattern + '/**')
+                self.include_prefixes.append(glob_prefix(pattern))
             elif line.startswith('exclude:'):
                 pattern = os.path.join(root, line[8:].strip(' /\\'))
-                exclude = exclude + '|' + glob_translate(pattern) + '|' + glob_translate(pattern + '/**')
+                self.exclude.add(pattern)
+                self.exclude.add(pattern + '/**')
             else:
                 raise ValueError('Invalid filter: ' + line)
-        self.exclude = re.compile(exclude)
 
-        if include is None:
-            include = glob_translate(root + '/**')
+        if not self.include_prefixes:
+            self.include.add(root + '/**')
+            self.include_prefixes.append(glob_prefix(root + '/**'))
 
-        self.include = re.compile(include)
+        self.include.compile()
+        self.exclude.compile()
 
     def includes(self, path):
         '''
@@ -59,70 +173,354 @@ class FileFilters:
         Returns True is the path is not excluded.
         '''
         path = path.replace('\\', '/')
-        return bool(self.include.match(path)) and not bool(self.exclude.match(path))
+        return self.include.match(path) and not self.exclude.match(path)
+
+    def skips_dir(self, path):
+        '''
+        Returns True if no file below the directory path can be included, either because the
+        directory itself matches an exclude pattern, or because it cannot lead to a path that
+        starts like an include pattern.
+        '''
+        path = path.replace('\\', '/')
+        if self.exclude.match(path):
+            return True
+        if not path.endswith('/'):
+            path = path + '/'
+        for prefix in self.include_prefixes:
+            if prefix.startswith(path) or path.startswith(prefix):
+                return False
+        return True
 
 
 class DirTrie:
+    '''
+    The trie is stored in flat arrays rather than as one object per path component:
+
+    - names: the interned path components; nodes refer to a component by its index
+    - node_key: for every node, the id of its component shifted left by one, with the low bit
+      set if the node marks a root rather than a directory
+    - node_parent: the parent of every node, node 0 being the top of the trie
+
+    While the trie is built, children are found through a single dict keyed by parent and key.
+    The first lookup freezes the trie: nodes are renumbered breadth-first with the children of
+    every node sorted by key, so that they occupy the node range child_start[n]:child_start[n + 1]
+    and are found by binary search. A frozen trie can be saved to a file and mapped back into
+    memory by a later run instead of being rebuilt.
+    '''
 
     def __init__(self):
-        self.trie = {}
+        self._clear()
+
+    def _clear(self):
+        self.names = []
+        self.name_ids = {}
+        self.node_key = array.array('I', [0])
+        self.node_parent = array.array('I', [0])
+        # (parent << EDGE_SHIFT) | key -> child, only while the trie is not frozen
+        self.edges = {}
+        # Set when the trie is frozen
+        self.child_start = None
+        # Caller-defined bytes saved with the trie, e.g. to check that a saved trie is current
+        self.stamp = b''
+        # Number of root markers, i.e. of files in the trie
+        self.file_count = 0
+        self._map = None
+
+    def _intern(self, name):
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.names.append(name)
+            self.name_ids[name] = name_id
+        return name_id
+
+    def _child(self, node, key):
+        edge = (node << EDGE_SHIFT) | key
+        child = self.edges.get(edge)
+        if child is None:
+            child = len(self.node_key)
+            self.edges[edge] = child
+            self.node_key.append(key)
+            self.node_parent.append(node)
+            if key & ROOT_BIT:
+                self.file_count += 1
+        return child
+
+    def _freeze(self):
+        if self.child_start is not None:
+            return
+        count = len(self.node_key)
+        ordered = sorted(self.edges.items())
+        # Range of each old node's children in ordered
+        first = array.array('I', bytes(4 * (count + 1)))
+        for edge, _child in ordered:
+            first[(edge >> EDGE_SHIFT) + 1] += 1
+        for node in range(count):
+            first[node + 1] += first[node]
+
+        old_ids = array.array('I', [0])
+        node_key = array.array('I', [0])
+        node_parent = array.array('I', [0])
+        child_start = array.array('I')
+        for node in range(count):
+            old = old_ids[node]
+            child_start.append(len(old_ids))
+            for i in range(first[old], first[old + 1]):
+                edge, child = ordered[i]
+                old_ids.append(child)
+                node_key.append(edge & KEY_MASK)
+                node_parent.append(node)
+        child_start.append(count)
+
+        self.node_key = node_key
+        self.node_parent = node_parent
+        self.child_start = child_start
+        self.edges = {}
+
+    def _thaw(self):
+        if self.child_start is None:
+            return
+        if self._map is not None:
+            # Copy the mapped arrays so that the trie can grow
+            for attr in ('node_key', 'node_parent'):
+                copy = array.array('I')
+                copy.frombytes(getattr(self, attr).cast('B'))
+                setattr(self, attr, copy)
+            self.child_start = None
+            self._map = None
+        node_key = self.node_key
+        node_parent = self.node_parent
+        self.edges = {(node_parent[node] << EDGE_SHIFT) | node_key[node]: node
+                      for node in range(1, len(node_key))}
+        self.child_start = None
+
+    def _find_child(self, node, key):
+        lo = self.child_start[node]
+        hi = self.child_start[node + 1]
+        i = bisect.bisect_left(self.node_key, key, lo, hi)
+        if i < hi and self.node_key[i] == key:
+            return i
+        return None
+
+    def _paths(self, top):
+        '''All paths from a root marker up to (excluding) the node top'''
+        names = self.names
+        node_key = self.node_key
+        node_parent = self.node_parent
+        child_start = self.child_start
+        result = []
+        stack = [top]
+        while stack:
+            node = stack.pop()
+            for child in range(child_start[node], child_start[node + 1]):
+                key = node_key[child]
+                if key & ROOT_BIT:
+                    path = [names[key >> 1]]
+                    parent = node
+                    while parent != top:
+                        path.append(names[node_key[parent] >> 1])
+                        parent = node_parent[parent]
+                    result.append(path)
+                else:
+                    stack.append(child)
+        return result
 
     def set_root(self, root):
-        self.trie[root] = DirTrie()
+        self._thaw()
+        self._child(0, (self._intern(root) << 1) | ROOT_BIT)
 
     def insert(self, item, root='.'):
         '''Insert an element into the trie'''
-        (path, last) = os.path.split(item)
-        sub_trie = self.trie.get(last)
-        if sub_trie is None:
-            sub_trie = DirTrie()
-            self.trie[last] = sub_trie
-
-        if path not in ('', os.path.sep):
-            sub_trie.insert(path, root)
-        else:
-            sub_trie.set_root(root)
+        self._thaw()
+        node = 0
+        path = item
+        while True:
+            (head, last) = os.path.split(path)
+            node = self._child(node, self._intern(last) << 1)
+            # A head of only separators ('//') does not split any further
+            if head in ('', os.path.sep) or head == path:
+                break
+            path = head
+        self._child(node, (self._intern(root) << 1) | ROOT_BIT)
 
     def add_files(self, items, root='.'):
         '''Add a set of files to the trie'''
         for item in items:
             self.insert(item, root)
 
-    def of_dir(self, root_dir, follow_symlinks=False):
+    def _insert_dir(self, dirpath, files, filter, root_dir_len, root_key):
+        '''Insert the included files of one directory, splitting the directory part only once'''
+        edges = self.edges
+        node_key = self.node_key
+        node_parent = self.node_parent
+        added = 0
+        head = None
+        head_keys = None
+        for filename in files:
+            fullname = os.path.join(dirpath, filename)
+            if not filter.includes(fullname):
+                continue
+            (path, last) = os.path.split(fullname[root_dir_len:])
+            if path != head:
+                head = path
+                head_keys = []
+                while path not in ('', os.path.sep):
+                    (parent, component) = os.path.split(path)
+                    head_keys.append(self._intern(component) << 1)
+                    if parent == path:
+                        break
+                    path = parent
+            # Inlined _child, this is the loop that indexes every file
+            node = 0
+            for key in [self._intern(last) << 1] + head_keys + [root_key]:
+                edge = (node << EDGE_SHIFT) | key
+                child = edges.get(edge)
+                if child is None:
+                    child = len(node_key)
+                    edges[edge] = child
+                    node_key.append(key)
+                    node_parent.append(node)
+                    if key == root_key:
+                        added += 1
+                node = child
+        self.file_count += added
+
+    def of_dir(self, root_dir, follow_symlinks=False, threads=None, dir_mtimes=None):
         '''
         Create a trie of all files in the given root_dir.
         Existing items will be discarded.
+
+        Directories that the filters exclude are not traversed. If threads is not 1, the
+        top-level subdirectories are listed by a pool of threads (by default one per CPU, at
+        most MAX_INDEX_THREADS) and merged into the trie as they complete.
+
+        If dir_mtimes is a list, (path, mtime in ns) is appended to it for every directory
+        listed, as taken before listing it; the mtime is None if root_dir cannot be listed.
         '''
 
         root_dir=str(root_dir)
 
         filter = FileFilters(root_dir)
 
-        self.trie={}
+        self._clear()
 
         root_dir_len=len(root_dir) + 1
-
-        for root, _dirs, files in os.walk(root_dir, followlinks=follow_symlinks):
-            for filename in files:
-                fullname = os.path.join(root, filename)
-                if filter.includes(fullname):
-                    name = fullname[root_dir_len:]
-                    self.insert(name, root_dir)
-
+        root_key = (self._intern(root_dir) << 1) | ROOT_BIT
+
+        if threads is None:
+            threads = min(MAX_INDEX_THREADS, os.cpu_count() or 1)
+
+        listing = None if filter.skips_dir(root_dir) else list_dir(root_dir, follow_symlinks)
+        if listing is None:
+            if dir_mtimes is not None:
+                dir_mtimes.append((root_dir, None))
+            return
+        (files, subdirs, mtime) = listing
+        if dir_mtimes is not None:
+            dir_mtimes.append((root_dir, mtime))
+        self._insert_dir(root_dir, files, filter, root_dir_len, root_key)
+        subdirs = [d for d in subdirs if not filter.skips_dir(d)]
+
+        if threads == 1 or len(subdirs) < 2:
+            for subdir in subdirs:
+                for dirpath, files, mtime in walk_dir(subdir, filter, follow_symlinks):
+                    if dir_mtimes is not None:
+                        dir_mtimes.append((dirpath, mtime))
+                    self._insert_dir(dirpath, files, filter, root_dir_len, root_key)
+        else:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                def index(subdir):
+                    return list(walk_dir(subdir, filter, follow_symlinks))
+                for listings in executor.map(index, subdirs):
+                    for dirpath, files, mtime in listings:
+                        if dir_mtimes is not None:
+                            dir_mtimes.append((dirpath, mtime))
+                        self._insert_dir(dirpath, files, filter, root_dir_len, root_key)
+
+    @classmethod
+    def of_dir_cached(cls, root_dir, cache_dir, follow_symlinks=False):
+        '''
+        A trie of all files in root_dir as of_dir creates it, saved in cache_dir and reused by
+        later calls while no directory in it has changed. Adding, removing or renaming a file
+        changes the mtime of its directory, so the mtimes of all directories are saved with
+        the trie (see stamp) and compared on load, along with the filters.
+        '''
+        root_dir = str(root_dir)
+        key = '{}\0{}'.format(root_dir, follow_symlinks).encode('utf-8', 'surrogateescape')
+        cache_file = os.path.join(cache_dir, hashlib.sha1(key).hexdigest() + '.trie')
+        try:
+            trie = cls.load(cache_file)
+            if trie.is_current(root_dir, follow_symlinks):
+                return trie
+        except (OSError, ValueError):
+            pass
+
+        trie = cls()
+        dir_mtimes = []
+        trie.of_dir(root_dir, follow_symlinks, dir_mtimes=dir_mtimes)
+        # A directory changed within the mtime granularity of the listing could look unchanged
+        settled = time.time_ns() - MTIME_SETTLE_NS
+        if all(mtime is None or mtime < settled for _, mtime in dir_mtimes):
+            trie.stamp = json.dumps({'root': root_dir, 'follow_symlinks': follow_symlinks,
+                                     'filters': os.environ.get('LGTM_INDEX_FILTERS', ''),
+                                     'dirs': dir_mtimes}).encode()
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                trie.save(cache_file)
+            except OSError:
+                pass
+        return trie
+
+    def is_current(self, root_dir, follow_symlinks):
+        '''Whether the stamp written by of_dir_cached matches the directories as they are now'''
+        try:
+            stamp = json.loads(self.stamp)
+            if (stamp['root'] != root_dir or stamp['follow_symlinks'] != follow_symlinks
+                    or stamp['filters'] != os.environ.get('LGTM_INDEX_FILTERS', '')):
+                return False
+            for dirpath, mtime in stamp['dirs']:
+                try:
+                    current = os.stat(dirpath).st_mtime_ns
+                except OSError:
+                    current = None
+                if current != mtime:
+                    return False
+        except (ValueError, KeyError, TypeError):
+            return False
+        return True
 
     def get_paths(self):
         '''Get all files in the trie'''
-        result = []
-        for key, value in self.trie.items():
-            if len(value) == 0:
-                # Leaf
-                result.append([key])
-            else:
-                paths = value.get_paths()
-                for path in paths:
-                    path.append(key)
-                    result.append(path)
-        return result
+        self._freeze()
+        return self._paths(0)
+
+    def iter_paths(self):
+        '''
+        Generate the full path of every file in the trie, as os.path.join(*path) for each path
+        of get_paths, without building the list of paths.
+        '''
+        names = self.names
+        node_key = self.node_key
+        node_parent = self.node_parent
+        # Below the root, components are directory entry names, which contain no separator:
+        # on posix, os.path.join only has to add the separators
+        posix = os.name == 'posix'
+        # Every root marker ends the path of one file; its components are its ancestors
+        for node in range(1, len(node_key)):
+            key = node_key[node]
+            if key & ROOT_BIT:
+                root = names[key >> 1]
+                path = []
+                parent = node_parent[node]
+                while parent != 0:
+                    path.append(names[node_key[parent] >> 1])
+                    parent = node_parent[parent]
+                if not posix or not path:
+                    yield os.path.join(root, *path)
+                elif root and not root.endswith('/'):
+                    yield root + '/' + '/'.join(path)
+                else:
+                    yield root + '/'.join(path)
 
     def lookup(self, item):
         '''
@@ -131,28 +529,150 @@ class DirTrie:
 
         Note that this function is not meant to lookup files specified using absolute paths.
         '''
-
-        (path, last) = os.path.split(item)
-        if last == '':
-            if path != '':
+        self._freeze()
+        node = 0
+        path = item
+        while True:
+            (path, last) = os.path.split(path)
+            if last == '':
+                if path != '':
+                    return []
+                return self._paths(node)
+            name_id = self.name_ids.get(last)
+            if name_id is None:
+                return []
+            node = self._find_child(node, name_id << 1)
+            if node is None:
                 return []
-            return self.get_paths()
-
-        result = self.trie.get(last)
-        if result is None:
-            return []
 
-        # Recursive descent
-        r = result.lookup(path)
-        return r
+    def save(self, filename):
+        '''
+        Write the trie to the given file, replacing it atomically.
+        The file can be mapped back into memory with DirTrie.load.
+        '''
+        self._freeze()
+        names = b'\0'.join(os.fsencode(name) for name in self.names)
+        header = HEADER.pack(MAGIC, len(self.node_key), self.file_count, len(self.names),
+                             len(names), len(self.stamp))
+        tmp = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(header)
+            f.write(self.node_key)
+            f.write(self.node_parent)
+            f.write(self.child_start)
+            f.write(names)
+            f.write(self.stamp)
+        os.replace(tmp, filename)
+
+    @classmethod
+    def load(cls, filename):
+        '''
+        Map a trie written by save into memory.
+        Raises ValueError if the file is not a saved trie.
+        '''
+        with open(filename, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(data) < HEADER.size:
+            raise ValueError('Not a saved DirTrie: ' + filename)
+        (magic, nodes, file_count, name_count, names_size, stamp_size) = HEADER.unpack_from(data)
+        offset = HEADER.size
+        end = offset + 4 * (3 * nodes + 1) + names_size + stamp_size
+        if magic != MAGIC or nodes == 0 or len(data) != end:
+            raise ValueError('Not a saved DirTrie: ' + filename)
+
+        view = memoryview(data)
+        trie = cls()
+        trie._map = data
+        trie.file_count = file_count
+        trie.node_key = view[offset:offset + 4 * nodes].cast('I')
+        offset += 4 * nodes
+        trie.node_parent = view[offset:offset + 4 * nodes].cast('I')
+        offset += 4 * nodes
+        trie.child_start = view[offset:offset + 4 * (nodes + 1)].cast('I')
+        offset += 4 * (nodes + 1)
+        if name_count > 0:
+            # Names contain no NUL, which the filesystem encoding only uses for NUL itself
+            trie.names = os.fsdecode(bytes(view[offset:offset + names_size])).split('\0')
+            trie.name_ids = {name: name_id for name_id, name in enumerate(trie.names)}
+        offset += names_size
+        trie.stamp = bytes(view[offset:offset + stamp_size])
+        return trie
 
     def __len__(self):
-        return len(self.trie)
+        self._freeze()
+        return self.child_start[1] - self.child_start[0]
+
+
+# Default limit of the threads listing directories in of_dir
+MAX_INDEX_THREADS = 8
+# Node key bit marking a root
+ROOT_BIT = 1
+# An edge packs the parent node above the child's key
+EDGE_SHIFT = 33
+KEY_MASK = (1 << EDGE_SHIFT) - 1
+# Directories modified less than this long ago are not trusted to show later changes
+MTIME_SETTLE_NS = 2 * 10**9
+# Saved trie: magic, node count, file count, name count, size of the names, size of the stamp
+HEADER = struct.Struct('<8sIIIII')
+MAGIC = b'DIRTRIE' + sys.byteorder[0].upper().encode()
+
+def list_dir(dirpath, follow_symlinks):
+    '''
+    List a directory as os.walk does: returns the names of its files, the paths of the
+    subdirectories to descend into and the mtime of the directory before it was listed, or None
+    if the directory cannot be read.
+    '''
+    files = []
+    subdirs = []
+    try:
+        mtime = os.stat(dirpath).st_mtime_ns
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    files.append(entry.name)
+                elif follow_symlinks or not entry.is_symlink():
+                    subdirs.append(os.path.join(dirpath, entry.name))
+    except OSError:
+        return None
+    return (files, subdirs, mtime)
+
+
+def walk_dir(top, filter, follow_symlinks):
+    '''
+    Yield (dirpath, filenames, mtime) for top and the directories below it, like os.walk, but
+    without descending into directories that the filter skips.
+    '''
+    stack = [top]
+    while stack:
+        dirpath = stack.pop()
+        listing = list_dir(dirpath, follow_symlinks)
+        if listing is None:
+            continue
+        (files, subdirs, mtime) = listing
+        yield (dirpath, files, mtime)
+        for subdir in reversed(subdirs):
+            if not filter.skips_dir(subdir):
+                stack.append(subdir)
+
+
+def glob_prefix(pat):
+    '''The literal part of a glob pattern before its first wildcard'''
+    pat = os.path.normpath(pat).replace('\\','/')
+    return re.split('[*?]', pat, maxsplit=1)[0]
+
 
 # A light version of glob.translate() which is only available from Python 3.13
 def glob_translate(pat):
     pat = os.path.normpath(pat).replace('\\','/')
-    result = '(?s:'
+    return '(?s:' + glob_regex(pat) + ')\\Z'
+
+def glob_regex(pat):
+    '''The regular expression for a normalized glob pattern, without flags or anchors'''
+    result = ''
     stars = 0
 
     def accept(c):
@@ -180,5 +700,4 @@ def glob_translate(pat):
             result += '[^/]*'
         else:
             result += '.*'
-    result += ')\\Z'
     return result
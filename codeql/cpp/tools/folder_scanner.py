@@ -12,8 +12,12 @@ class FolderScanner:
         if self.verbose:
             print(msg)
 
-    def __init__(self, cpp_source_extensions=None, cpp_header_extensions=None, verbose=False):
-        """Create an empty FolderScanner"""
+    def __init__(self, cpp_source_extensions=None, cpp_header_extensions=None, verbose=False,
+                 include_cache=None):
+        """
+        Create an empty FolderScanner. include_cache is the file in which the includes of
+        scanned files are kept between runs, or None to only cache them in memory.
+        """
         # Dir trie used to index the files
         self.dir_trie = DirTrie()
 
@@ -26,7 +30,7 @@ class FolderScanner:
         # Set of visited files.
         self.visited_files = set()
         # Include file extractor. As it contains a cache of file --> include files it should be reused
-        self.include_extractor = IncludeExtractor()
+        self.include_extractor = IncludeExtractor(include_cache)
         # Set of missing include files still left after the processing
         self.missing_includes = set()
         # Set of include directories to be used to resolve includes. Represented with an ordered dict
@@ -35,6 +39,31 @@ class FolderScanner:
         # List of tries for the include directories added by default by the compiler configuration
         self.default_include_dirs = []
 
+        # Root of the last scan_dir
+        self.root_dir = None
+        # Caches for include resolution, only valid for the indexed files (see scan_dir)
+        # include file --> (full path or None, number of include_dirs searched for it)
+        self.include_dir_hits = {}
+        # The include_dirs as of the last include resolution, in order, and their positions
+        self.include_dir_list = []
+        self.include_dir_positions = {}
+        # Whether include_dir_list can be searched through the trie (see update_include_dir_index)
+        self.include_dirs_indexed = False
+        # include file --> whether it is reachable from a default include directory
+        self.default_include_cache = {}
+        # include file --> candidates (dir, full path, path_depth of the dir) in the trie
+        self.include_candidates = {}
+        # (include file, including directory or file) --> result of resolve_include
+        self.resolved_includes = {}
+        # path --> (components as os.path.commonpath compares them, number of separators)
+        self.path_depths = {}
+        # file --> its includes resolved on their own (see get_include_edges)
+        self.include_edges = {}
+        # file --> summary of everything it includes (see get_include_summary)
+        self.include_summaries = {}
+        # One instance of each distinct summary, shared by the files that have it
+        self.summary_pool = {}
+
         # Set of common C/C++ source file extensions
         self.cpp_source_extensions = ['.c', '.cpp', '.cc', '.cxx',
                                       '.c++'] if cpp_source_extensions is None else cpp_source_extensions
@@ -45,18 +74,27 @@ class FolderScanner:
         # Verbose logging
         self.verbose = verbose
 
-    def scan_dir(self, root_dir, follow_symlinks=False, system_include_dirs=None):
-        """Scan a directory and index its files"""
-        self.dir_trie.of_dir(root_dir, follow_symlinks)
-        all_files = self.dir_trie.get_paths()
-        # Computing some stats
-        for path in all_files:
-            fullname = os.path.join(*path)
+    def scan_dir(self, root_dir, follow_symlinks=False, system_include_dirs=None,
+                 index_cache_dir=None):
+        """
+        Scan a directory and index its files. If index_cache_dir is given, the indexes of the
+        directory and of the system include directories are saved there and reused by later
+        scans while the directories are unchanged (see DirTrie.of_dir_cached).
+        """
+        if index_cache_dir is None:
+            self.dir_trie.of_dir(root_dir, follow_symlinks)
+        else:
+            self.dir_trie = DirTrie.of_dir_cached(root_dir, index_cache_dir, follow_symlinks)
+        self.root_dir = str(root_dir)
+        self.clear_include_caches()
+        # Classify the files as the trie generates them, without first listing them
+        for fullname in self.dir_trie.iter_paths():
             self.all_files.add(fullname)
             _, file_extension = os.path.splitext(fullname)
-            if file_extension.lower() in self.cpp_source_extensions:
+            file_extension = file_extension.lower()
+            if file_extension in self.cpp_source_extensions:
                 self.source_files.add(fullname)
-            elif file_extension.lower() in self.cpp_header_extensions:
+            elif file_extension in self.cpp_header_extensions:
                 self.header_files.add(fullname)
 
         print("Indexing folder {}, found {} source files, {} header files, {} total files.".format(
@@ -64,12 +102,29 @@ class FolderScanner:
 
         if system_include_dirs is not None:
             for system_dir in system_include_dirs:
-                compiler_include_dir_trie = DirTrie()
-                compiler_include_dir_trie.of_dir(system_dir, follow_symlinks)
-                self.print_if(
-                    f"Added system include dir {system_dir}. Indexed {len(compiler_include_dir_trie.get_paths())} files")
+                if index_cache_dir is None:
+                    compiler_include_dir_trie = DirTrie()
+                    compiler_include_dir_trie.of_dir(system_dir, follow_symlinks)
+                else:
+                    compiler_include_dir_trie = DirTrie.of_dir_cached(
+                        system_dir, index_cache_dir, follow_symlinks)
+                self.print_if(f"Added system include dir {system_dir}. "
+                              f"Indexed {compiler_include_dir_trie.file_count} files")
                 self.default_include_dirs.append(compiler_include_dir_trie)
 
+    def clear_include_caches(self):
+        """Forget cached include resolutions, which depend on the indexed files"""
+        self.include_dir_hits = {}
+        self.include_dir_list = []
+        self.include_dir_positions = {}
+        self.include_dirs_indexed = False
+        self.default_include_cache = {}
+        self.include_candidates = {}
+        self.resolved_includes = {}
+        self.include_edges = {}
+        self.include_summaries = {}
+        self.summary_pool = {}
+
     def file_exists(self, fullpath):
         """Test if a file exists"""
         return fullpath in self.all_files
@@ -96,6 +151,47 @@ class FolderScanner:
 
         return (src_dirs - common_dirs) * 1000 + (include_dirs - common_dirs)
 
+    def path_depth(self, path):
+        """
+        The components of an absolute path as os.path.commonpath compares them, and its number
+        of separators. Returns None where include_dir_distance must be used instead.
+        """
+        depth = self.path_depths.get(path, False)
+        if depth is False:
+            depth = None
+            # Only posix paths are simple enough: ntpath.commonpath also handles drives and case
+            if os.name == 'posix' and path.startswith('/'):
+                depth = (tuple(c for c in path.split('/') if c and c != '.'), path.count('/'))
+            self.path_depths[path] = depth
+        return depth
+
+    def indexed_include_dir_distance(self, src, src_depth, include_dir, include_depth):
+        """include_dir_distance using the precomputed depths of path_depth"""
+        if src_depth is None or include_depth is None:
+            return self.include_dir_distance(src, include_dir)
+        (src_parts, src_seps) = src_depth
+        (include_parts, include_seps) = include_depth
+        common = 0
+        for a, b in zip(src_parts, include_parts):
+            if a != b:
+                break
+            common += 1
+        # os.path.commonpath is '/' followed by the common components
+        common_dirs = common + 1
+        return (src_seps - 1 - common_dirs) * 1000 + (include_seps - common_dirs)
+
+    def get_include_candidates(self, include_file):
+        """The directories that contain include_file, with the full paths and path_depth"""
+        candidates = self.include_candidates.get(include_file)
+        if candidates is None:
+            candidates = []
+            for d in self.dir_trie.lookup(include_file):
+                fulldir = os.path.join(*d)  # This is the dir to be included.
+                fullpath = os.path.join(fulldir, include_file)
+                candidates.append((fulldir, fullpath, self.path_depth(fulldir)))
+            self.include_candidates[include_file] = candidates
+        return candidates
+
     def resolve_include(self, src, include_file):
         """
         Resolve an include based on file it's included from.
@@ -103,19 +199,29 @@ class FolderScanner:
         or none if there is no solution
         """
 
-        dirs = self.dir_trie.lookup(include_file)
-        if dirs == []:
+        candidates = self.get_include_candidates(include_file)
+        if not candidates:
             return None
 
-        candidates = []
-        for d in dirs:
-            fulldir = os.path.join(*d)  # This is the dir to be included.
-            fullpath = os.path.join(fulldir, include_file)
-            distance = self.include_dir_distance(src, fulldir)
-            candidates.append((distance, (fulldir, fullpath)))
-            # No need to check if already in one of the include dirs as this is done earlier
+        src_depth = self.path_depth(src)
+        return min((self.indexed_include_dir_distance(src, src_depth, fulldir, depth),
+                    (fulldir, fullpath)) for fulldir, fullpath, depth in candidates)[1]
 
-        return min(candidates)[1]
+    def resolve_include_cached(self, src, include_file):
+        """
+        resolve_include, shared by all files in a directory. An indexed file's own name never
+        takes part in the distance (no indexed directory is below a file), so its directory
+        is enough; anything else is cached by its full path.
+        """
+        if src in self.all_files:
+            key = (include_file, os.path.dirname(src), True)
+        else:
+            key = (include_file, src, False)
+        resolved = self.resolved_includes.get(key, False)
+        if resolved is False:
+            resolved = self.resolve_include(src, include_file)
+            self.resolved_includes[key] = resolved
+        return resolved
 
     def exists_on_disk(self, include_file, include_dirs):
         """
@@ -130,6 +236,71 @@ class FolderScanner:
 
         return None
 
+    def update_include_dir_index(self):
+        """
+        Catch up with the directories added to include_dirs since the last include resolution.
+
+        The include directories can be searched through the trie rather than one by one when
+        the trie holds exactly the indexed files and every include directory is a normalized
+        absolute directory under the scanned root, as resolve_include adds them. Then
+        os.path.abspath(os.path.join(d, include)) is an indexed file exactly when d is one of
+        the include's candidates.
+        """
+        dirs = list(self.include_dirs)
+        old_dirs = self.include_dir_list
+        if not old_dirs or dirs[:len(old_dirs)] != old_dirs:
+            # First directories, or include_dirs was changed other than by appending: start again
+            self.include_dir_hits = {}
+            old_dirs = []
+            self.include_dir_positions = {}
+            root = self.root_dir
+            self.include_dirs_indexed = (os.name == 'posix' and root is not None
+                                         and os.path.isabs(root) and os.path.normpath(root) == root
+                                         and len(self.all_files) == self.dir_trie.file_count)
+        positions = self.include_dir_positions
+        for d in dirs[len(old_dirs):]:
+            positions.setdefault(d, len(positions))
+            if self.include_dirs_indexed and not self.is_indexed_dir(d):
+                self.include_dirs_indexed = False
+        self.include_dir_list = dirs
+
+    def is_indexed_dir(self, d):
+        root = self.root_dir
+        return (os.path.normpath(d) == d
+                and (d == root or d.startswith(root if root.endswith('/') else root + '/')))
+
+    @staticmethod
+    def is_normalized_include(include_file):
+        return (os.path.normpath(include_file) == include_file and include_file != '.'
+                and not include_file.startswith('../') and include_file != '..'
+                and not include_file.startswith('/'))
+
+    def find_in_include_dirs(self, include_file):
+        """
+        exists_on_disk(include_file, self.include_dirs.keys()), using the trie where possible (see
+        update_include_dir_index). Otherwise the directories searched for each include file are
+        remembered: directories are only ever appended, so a file that was found stays found and
+        a miss only has to search the directories added since.
+        """
+        if len(self.include_dir_list) != len(self.include_dirs):
+            self.update_include_dir_index()
+        dirs = self.include_dir_list
+        if self.include_dirs_indexed and self.is_normalized_include(include_file):
+            positions = self.include_dir_positions
+            best = None
+            for fulldir, _fullpath, _depth in self.get_include_candidates(include_file):
+                position = positions.get(fulldir)
+                if position is not None and (best is None or position < best):
+                    best = position
+            if best is None:
+                return None
+            return os.path.abspath(os.path.join(dirs[best], include_file))
+        (found, searched) = self.include_dir_hits.get(include_file, (None, 0))
+        if found is None and searched < len(dirs):
+            found = self.exists_on_disk(include_file, dirs[searched:])
+            self.include_dir_hits[include_file] = (found, len(dirs))
+        return found
+
     @staticmethod
     def is_absolute(path):
         """
@@ -146,13 +317,19 @@ class FolderScanner:
         This is done by checking if the include is in one of the default include dir_tries and that
         the include is reachable from the root of such dir_trie.
         """
+        cached = self.default_include_cache.get(include)
+        if cached is not None:
+            return cached
+        result = False
         for system_dir_trie in self.default_include_dirs:
             paths = system_dir_trie.lookup(include)
             if any(len(path) == 1 for path in paths):
                 # At least one file with path ending in `include` is in the default include dir_trie
-                return True
+                result = True
+                break
 
-        return False
+        self.default_include_cache[include] = result
+        return result
 
     def compute_include_dirs_from_include_list(self, includes, src):
         """
@@ -174,7 +351,7 @@ class FolderScanner:
             # Check if the include file is already in the detected include directories
             # Detected include directories have precedence to the system ones added by the compiler,
             # so still checking to avoid shadowing
-            include_file = self.exists_on_disk(current_include, self.include_dirs.keys())
+            include_file = self.find_in_include_dirs(current_include)
             # Could we find it?
             if include_file is None:
 
@@ -188,7 +365,7 @@ class FolderScanner:
                     # We also assume that all its sub-includes are satisfied.
                     continue
 
-                inc = self.resolve_include(current_src, current_include)
+                inc = self.resolve_include_cached(current_src, current_include)
                 if inc is None:
                     self.missing_includes.add(current_include)
                     self.print_if(f"Include {current_include} still missing")
@@ -214,3 +391,122 @@ class FolderScanner:
         include_files = self.include_extractor.extract_includes(src)
         self.compute_include_dirs_from_include_list(include_files, src)
         return self.include_dirs.keys()
+
+    def get_include_edges(self, file):
+        """
+        The includes of a file, each resolved on its own rather than against the include
+        directories found so far: a tuple of (include directory to add or None, included file or
+        None, missing include or None). Absolute includes and includes satisfied by the default
+        include directories are left out. Relative includes are looked up next to the including
+        file, as compilers do.
+        """
+        edges = self.include_edges.get(file)
+        if edges is not None:
+            return edges
+
+        edges = []
+        for include in self.include_extractor.extract_includes(file):
+            if self.is_absolute(include):
+                continue
+            if include[0] == '.':
+                fullpath = os.path.abspath(os.path.join(os.path.dirname(file), include))
+                if self.file_exists(fullpath):
+                    edges.append((None, fullpath, None))
+                continue
+            if self.is_default_include(include):
+                continue
+            inc = self.resolve_include_cached(file, include)
+            if inc is None:
+                self.print_if(f"Include {include} still missing")
+                edges.append((None, None, include))
+            else:
+                edges.append((inc[0], inc[1], None))
+
+        edges = tuple(edges)
+        self.include_edges[file] = edges
+        return edges
+
+    def get_include_summary(self, file):
+        """
+        Summarize everything a file includes, directly or not: (tuple of the include directories
+        to add, frozenset of the includes that could not be resolved).
+
+        Summaries are memoized, so a header is solved once however many files include it. Files
+        that include each other (a strongly connected component of the include graph) share one
+        summary, built from its members in path order, so that a summary does not depend on
+        which file the graph was entered from.
+        """
+        summaries = self.include_summaries
+        summary = summaries.get(file)
+        if summary is not None:
+            return summary
+
+        # Iterative Tarjan's algorithm over the files not summarized yet
+        index = {file: 0}
+        low = {file: 0}
+        stack = [file]
+        on_stack = {file}
+        work = [(file, 0)]
+        while work:
+            node, i = work[-1]
+            edges = self.get_include_edges(node)
+            while i < len(edges):
+                target = edges[i][1]
+                i += 1
+                if target is None or target in summaries:
+                    continue
+                if target not in index:
+                    work[-1] = (node, i)
+                    index[target] = low[target] = len(index)
+                    stack.append(target)
+                    on_stack.add(target)
+                    work.append((target, 0))
+                    break
+                if target in on_stack and index[target] < low[node]:
+                    low[node] = index[target]
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    if low[node] < low[parent]:
+                        low[parent] = low[node]
+                if low[node] == index[node]:
+                    members = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        members.append(member)
+                        if member == node:
+                            break
+                    self.summarize_includes(members)
+
+        return summaries[file]
+
+    def summarize_includes(self, members):
+        """
+        Build the summary of a strongly connected component of the include graph, whose
+        outgoing edges all lead to summarized files
+        """
+        summaries = self.include_summaries
+        member_set = set(members)
+        include_dirs = {}
+        missing = set()
+        merged = set()
+        for member in sorted(members):
+            for include_dir, target, include in self.get_include_edges(member):
+                if include_dir is not None:
+                    include_dirs[include_dir] = None
+                if include is not None:
+                    missing.add(include)
+                if target is not None and target not in member_set:
+                    summary = summaries[target]
+                    # Many includes share a summary: merge each one once
+                    if id(summary) not in merged:
+                        merged.add(id(summary))
+                        include_dirs.update(dict.fromkeys(summary[0]))
+                        missing.update(summary[1])
+        summary = (tuple(include_dirs), frozenset(missing))
+        summary = self.summary_pool.setdefault(summary, summary)
+        for member in members:
+            summaries[member] = summary
+
@@ -1,4 +1,8 @@
+import json
+import mmap
+import os
 import re
+import time
 
 
 class IncludeExtractor:
@@ -8,15 +12,132 @@ class IncludeExtractor:
     # Capture everything between the " and " or between the < and >
     include_re = re.compile(r'^\s*#\s*include\s*[<"]([^">]+)[">]')
 
-    def __init__(self):
+    # A line terminator, as in text mode (universal newlines)
+    line_end_re = re.compile(rb'[\r\n]')
+
+    # Files of at least this size are mapped into memory instead of being read
+    mmap_threshold = 1 << 20
+
+    # Version of the persistent cache format
+    cache_version = 2
+
+    # Files modified less than this long ago are not cached persistently: a change within the
+    # same mtime tick that keeps the size would not be noticed
+    cache_settle_ns = 2 * 10**9
+
+    # Persistent cache entries not used for this many days are dropped when the cache is saved,
+    # and at most this many entries are kept, the most recently used ones. Without a bound the
+    # cache would keep every file ever scanned on the machine, in any checkout.
+    cache_max_age_days = 30
+    cache_max_entries = 200000
+
+    def __init__(self, cache_file=None):
         # Include file cache
         self.include_files_cache = {}
+        # Persistent include cache, loaded from and saved to cache_file if one is given.
+        # Maps an absolute path to [size, mtime in ns, includes, day last used]
+        self.cache_file = cache_file
+        self.persistent_cache = {}
+        self.persistent_cache_changed = False
+        # Entries added to or used from the persistent cache since the last
+        # take_new_cache_entries
+        self.new_cache_entries = {}
+        self.today = int(time.time() // 86400)
+        if cache_file is not None:
+            self.load_cache()
+
+    def load_cache(self):
+        """Load the persistent include cache, ignoring a missing or unreadable file"""
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.cache_version:
+                self.persistent_cache = data['files']
+        except (OSError, ValueError, KeyError, AttributeError):
+            self.persistent_cache = {}
+
+    def prune_cache(self):
+        """Drop the persistent cache entries that were not used recently"""
+        oldest = self.today - self.cache_max_age_days
+        entries = [(key, entry) for key, entry in self.persistent_cache.items()
+                   if entry[3] >= oldest]
+        if len(entries) > self.cache_max_entries:
+            entries.sort(key=lambda item: item[1][3], reverse=True)
+            del entries[self.cache_max_entries:]
+        if len(entries) < len(self.persistent_cache):
+            self.persistent_cache = dict(entries)
+
+    def save_cache(self):
+        """Write the persistent include cache if it changed, replacing the file atomically"""
+        if self.cache_file is None or not self.persistent_cache_changed:
+            return
+        self.prune_cache()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+            tmp = '{}.{}.tmp'.format(self.cache_file, os.getpid())
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.cache_version, 'files': self.persistent_cache}, f)
+            os.replace(tmp, self.cache_file)
+            self.persistent_cache_changed = False
+        except OSError as e:
+            print('Could not write the include cache', self.cache_file, 'because', e)
+
+    def take_new_cache_entries(self):
+        """Return the persistent cache entries added or used since the last call, for another process"""
+        entries = self.new_cache_entries
+        self.new_cache_entries = {}
+        return entries
+
+    def add_cache_entries(self, entries):
+        """Add persistent cache entries taken from another process"""
+        if entries:
+            self.persistent_cache.update(entries)
+            self.persistent_cache_changed = True
 
     def extract_includes(self, file):
         """Get all files referenced in include preprocessor statements"""
         if self.include_files_cache.get(file) is not None:
             return self.include_files_cache.get(file)
 
+        if self.cache_file is None:
+            includes = self.scan_file(file)
+        else:
+            key = os.path.abspath(file)
+            stat = os.stat(file)
+            entry = self.persistent_cache.get(key)
+            if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                includes = entry[2]
+                # Entries are marked as used at most once a day, so that a run using only cached
+                # entries usually does not rewrite the cache
+                if entry[3] != self.today:
+                    entry[3] = self.today
+                    self.new_cache_entries[key] = entry
+                    self.persistent_cache_changed = True
+            else:
+                includes = self.scan_file(file)
+                if stat.st_mtime_ns < time.time_ns() - self.cache_settle_ns:
+                    entry = [stat.st_size, stat.st_mtime_ns, includes, self.today]
+                    self.persistent_cache[key] = entry
+                    self.new_cache_entries[key] = entry
+                    self.persistent_cache_changed = True
+
+        self.include_files_cache[file] = includes
+        return includes
+
+    def scan_file(self, file):
+        """Extract the includes of a file, working on its bytes where possible"""
+        with open(file, 'rb') as f:
+            if os.fstat(f.fileno()).st_size >= self.mmap_threshold:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    includes = self.scan_bytes(data)
+            else:
+                includes = self.scan_bytes(f.read())
+        if includes is None:
+            includes = self.scan_text(file)
+        return includes
+
+    def scan_text(self, file):
+        """Extract the includes of a file by matching every line of its text"""
         includes = []
 
         with open(file, 'r', errors='ignore', encoding='utf-8') as f:
@@ -28,5 +149,37 @@ class IncludeExtractor:
                     include = include.replace('\\', '/')
                     includes.append(include)
 
-        self.include_files_cache[file] = includes
-        return includes
\ No newline at end of file
+        return includes
+
+    def scan_bytes(self, data):
+        """
+        Extract the includes from the bytes of a file, with the same result as scan_text.
+        Only the lines containing 'include' are decoded and matched. This is exact for valid
+        UTF-8, where no bytes are dropped by decoding; returns None for anything else.
+        """
+        if not (isinstance(data, bytes) and data.isascii()):
+            try:
+                str(data, 'utf-8')
+            except UnicodeDecodeError:
+                return None
+
+        includes = []
+        size = len(data)
+        line_end = self.line_end_re.search
+        # End of the last line looked at, so that looking back for a line start is bounded
+        floor = 0
+        pos = data.find(b'include')
+        while pos >= 0:
+            start = max(data.rfind(b'\n', floor, pos), data.rfind(b'\r', floor, pos), floor - 1) + 1
+            m = line_end(data, pos)
+            end = m.start() if m else size
+            m = self.include_re.match(str(data[start:end], 'utf-8'))
+            if m:
+                include = m.group(1)
+                # Map '\' to '/' to be more platform-agnostic.
+                include = include.replace('\\', '/')
+                includes.append(include)
+            floor = end
+            pos = data.find(b'include', end)
+
+        return includes
@@ -6,11 +6,14 @@ import subprocess
 import json
 import tempfile
 import multiprocessing
-from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor,
+                                wait)
 import pathlib
 import shutil
 import shlex
 import time
+import heapq
+import itertools
 
 import dependency_resolver
 from folder_scanner import FolderScanner
@@ -26,6 +29,23 @@ def shlex_join(split_command):
     return ' '.join(shlex.quote(x) for x in split_command)
 
 
+# Sources per task when computing include closures in worker processes
+min_closure_chunk = 64
+
+# The FolderScanner of the CompileCommands computing include closures, for forked workers
+closure_scanner = None
+
+
+def get_include_summaries(sources):
+    '''
+    Computes the include summaries of the given sources in a worker process. Also returns the
+    include cache entries the worker added, so that the parent can save them.
+    '''
+    include_extractor = closure_scanner.include_extractor
+    return ([closure_scanner.get_include_summary(src) for src in sources],
+            include_extractor.take_new_cache_entries())
+
+
 class CompileCommands:
     '''
     Class to construct the compile_commands.json file
@@ -36,56 +56,113 @@ class CompileCommands:
         self.cpp_compiler = compiler.get_cpp_compiler_prefix()
         self.c_compiler = compiler.get_c_compiler_prefix()
         self.repo_dir = repo_dir
-        self.folder_scanner = FolderScanner()
+        self.cache_dir = cache_dir()
+        include_cache = None
+        if self.cache_dir is not None:
+            include_cache = os.path.join(self.cache_dir, 'includes.json')
+        self.folder_scanner = FolderScanner(include_cache=include_cache)
 
     def find_files(self):
         """ Initialize all files in the repo directory """
         self.folder_scanner.scan_dir(self.repo_dir)
 
-    def get_compile_commands(self):
+    def get_include_closures(self, sources, threads):
+        '''
+        Returns the include summary (include directories, missing includes) of each source, see
+        FolderScanner.get_include_summary. Sources are independent of each other, so they are
+        split into runs of neighbouring sources (which tend to share headers) for worker
+        processes. The workers are forked, inheriting the indexed FolderScanner.
+        '''
+        if (threads <= 1 or len(sources) < 2 * min_closure_chunk
+                or 'fork' not in multiprocessing.get_all_start_methods()):
+            return [self.folder_scanner.get_include_summary(src) for src in sources]
+
+        global closure_scanner
+        closure_scanner = self.folder_scanner
+        chunk_size = max(min_closure_chunk, len(sources) // (threads * 4))
+        chunks = [sources[i:i + chunk_size] for i in range(0, len(sources), chunk_size)]
+        closures = []
+        try:
+            with ProcessPoolExecutor(threads, mp_context=multiprocessing.get_context('fork')) as executor:
+                for chunk_closures, cache_entries in executor.map(get_include_summaries, chunks):
+                    closures += chunk_closures
+                    self.folder_scanner.include_extractor.add_cache_entries(cache_entries)
+        finally:
+            closure_scanner = None
+        return closures
+
+    def get_compile_commands(self, threads=None):
         '''
         Returns the list of all compile commands.
         '''
-        compile_commands = []
-        for src in sorted(self.folder_scanner.source_files):
-            cmd_line = []
+        return list(self.iter_compile_commands(threads))
+
+    def iter_compile_commands(self, threads=None):
+        '''
+        Generates the compile commands one at a time. The include closures of all sources are
+        computed first, as the system include directories needed by any of them are added to
+        every command; the commands themselves are only built as they are consumed.
+        '''
+        if threads is None:
+            threads = get_thread_count()
+        sources = sorted(self.folder_scanner.source_files)
+        closures = self.get_include_closures(sources, threads)
+        for _, missing_includes in closures:
+            self.folder_scanner.missing_includes.update(missing_includes)
+        # Saved before the dependency resolver loads it, so that it sees these files
+        self.folder_scanner.include_extractor.save_cache()
+        extra_include_arg = None
+        if resolve_dependencies():
+            print("Scanning system directories")
+            extra_include_folders = dependency_resolver.get_missing_system_includes(
+                self.folder_scanner.missing_includes, self.compiler.clangpp,
+                verbose=verbose_output(), cache_dir=self.cache_dir)
+            extra_include_arg = shlex_join(
+                [self.compiler.include(i) for i in extra_include_folders])
+
+        # Include directories --> their arguments; sources with the same closure share them
+        include_args = {}
+        for src, (include_dirs, _) in zip(sources, closures):
             if src.lower().endswith('.c'):
-                cmd_line += self.c_compiler
+                cmd_line = self.c_compiler
             else:
-                cmd_line += self.cpp_compiler
+                cmd_line = self.cpp_compiler
 
             # Add include directives needed to satisfy include statements.
-            for i in self.folder_scanner.get_include_dirs_from_source(src):
-                cmd_line.append(self.compiler.include(i))
+            args = include_args.get(include_dirs)
+            if args is None:
+                args = shlex_join([self.compiler.include(i) for i in include_dirs])
+                include_args[include_dirs] = args
 
             out = src + ".o"
             compile_command = {}
             compile_command['directory'] = self.repo_dir
-            compile_command['command'] = shlex_join(
-                cmd_line + self.compiler.output(out) + self.compiler.source(src))
-            compile_command['output'] = out
-            compile_command['file'] = src
-            compile_commands.append(compile_command)
-        if resolve_dependencies():
-            print("Scanning system directories")
-            extra_include_folders = dependency_resolver.get_missing_system_includes(
-                self.folder_scanner.missing_includes, self.compiler.clangpp,
-                verbose=verbose_output())
-            extra_include_arg = shlex_join(
-                [self.compiler.include(i) for i in extra_include_folders])
-            for compile_command in compile_commands:
+            compile_command['command'] = ' '.join(part for part in (
+                shlex_join(cmd_line), args,
+                shlex_join(self.compiler.output(out) + self.compiler.source(src))) if part)
+            if extra_include_arg is not None:
                 compile_command['command'] = '{} {}'.format(compile_command['command'],
                                                             extra_include_arg)
-        return compile_commands
+            compile_command['output'] = out
+            compile_command['file'] = src
+            yield compile_command
 
     def write_compile_commands(self, compile_commands, output):
         '''
-        Write compile_commands.json to the given file.
+        Write compile_commands.json to the given file, encoding one command at a time, so
+        compile_commands can be an iterator of commands produced as they are written.
+        The result is the same as json.JSONEncoder(indent=4).encode(list(compile_commands)).
         '''
         encoder = json.JSONEncoder(indent=4)
 
         with open(output, "w") as text_file:
-            text_file.write(encoder.encode(compile_commands))
+            written = 0
+            for compile_command in compile_commands:
+                text_file.write(',\n    ' if written else '[\n    ')
+                # Indent the command as a list element. JSON strings contain no raw newlines.
+                text_file.write(encoder.encode(compile_command).replace('\n', '\n    '))
+                written += 1
+            text_file.write('\n]' if written else '[]')
 
         print('Written', output)
 
@@ -97,8 +174,7 @@ def generate_compile_commands_json(dir, compiler, json_file):
     print('Generating compilation commands...')
     cc = CompileCommands(dir, compiler)
     cc.find_files()
-    commands = cc.get_compile_commands()
-    cc.write_compile_commands(commands, json_file)
+    cc.write_compile_commands(cc.iter_compile_commands(), json_file)
 
 
 def getVarDir(name):
@@ -117,11 +193,13 @@ class CommandWithResponse:
     with an `@` file containing the arguments.
     '''
 
-    def __init__(self, line, compiler):
+    def __init__(self, line, compiler, source=None):
         l = shlex.split(line)
         self.command = l[:1] if len(l) > 0 else []
         self.args = l[1:] if len(l) > 1 else []
         self.compiler = compiler
+        # The source file compiled, used to estimate the cost of the command
+        self.source = source
 
     def write_response_file(self, response_file):
         self.compiler.write_response_file(response_file, self.args)
@@ -230,30 +308,258 @@ class CodeQLExecutor:
             raise RuntimeError("Executor is not initialized. Use the wrapper within a 'with' statement.")
         return self._executor.submit(fn, *args, **kwargs)
 
+# Extensions of the files counted as headers when estimating the cost of a command. C++
+# standard library headers have none.
+header_extensions = ('.h', '.hh', '.hpp', '.hxx', '.h++', '.inc', '')
+
+# Commands read between launches when they are read as they run (see run_commands_in_parallel)
+read_batch_size = 64
+# Characters of compile_commands.json read at a time (see read_compile_commands)
+read_chunk_size = 1 << 20
+
+# Memory assumed for one extractor process: a base plus a multiple of the estimated cost
+job_memory_base = 256 * 1024 * 1024
+job_memory_per_cost = 8
+
+
+class CostEstimator:
+    '''
+    Estimates the cost of a compile command from the size of its source and of its include
+    closure. The closure is approximated by the headers directly in the command's include
+    directories, which are those the closure spans (see FolderScanner.get_include_summary).
+    Directory sizes are memoized, as commands share most of their include directories.
+    '''
+
+    def __init__(self):
+        # directory --> total size of the headers in it
+        self.header_bytes = {}
+        # include directories of a command --> their total header size
+        self.include_costs = {}
+
+    def get_header_bytes(self, d):
+        size = self.header_bytes.get(d)
+        if size is None:
+            size = 0
+            try:
+                with os.scandir(d) as entries:
+                    for entry in entries:
+                        if os.path.splitext(entry.name)[1].lower() in header_extensions:
+                            try:
+                                if entry.is_file():
+                                    size += entry.stat().st_size
+                            except OSError:
+                                pass
+            except OSError:
+                pass
+            self.header_bytes[d] = size
+        return size
+
+    def estimate(self, command):
+        include_dirs = tuple(d for d in map(command.compiler.include_dir, command.args)
+                             if d is not None)
+        cost = self.include_costs.get(include_dirs)
+        if cost is None:
+            cost = sum(self.get_header_bytes(d) for d in include_dirs)
+            self.include_costs[include_dirs] = cost
+        if command.source is not None:
+            try:
+                cost += os.path.getsize(command.source)
+            except OSError:
+                pass
+        return cost
+
+
+def get_available_memory():
+    '''
+    The memory available for running commands in bytes: the available physical memory, within
+    any cgroup limit and CODEQL_RAM (in MB), or None if it cannot be determined.
+    '''
+    available = None
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError):
+        pass
+    if available is None and hasattr(os, 'sysconf'):
+        try:
+            available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (ValueError, OSError):
+            pass
+    if available is None and os.name == 'nt':
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('length', ctypes.c_ulong), ('load', ctypes.c_ulong),
+                        ('total_phys', ctypes.c_ulonglong), ('avail_phys', ctypes.c_ulonglong),
+                        ('total_page', ctypes.c_ulonglong), ('avail_page', ctypes.c_ulonglong),
+                        ('total_virtual', ctypes.c_ulonglong), ('avail_virtual', ctypes.c_ulonglong),
+                        ('avail_extended', ctypes.c_ulonglong)]
+        status = MemoryStatus()
+        status.length = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            available = status.avail_phys
+    limits = [] if available is None else [available]
+    for cgroup_file in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(cgroup_file, 'r') as f:
+                limits.append(int(f.read().strip()))
+            break
+        except (OSError, ValueError):
+            pass
+    try:
+        limits.append(int(os.environ['CODEQL_RAM']) * 1024 * 1024)
+    except (KeyError, ValueError):
+        pass
+    return min(limits) if limits else None
+
+
+def open_timing_log():
+    '''
+    Opens the log to which run_commands_in_parallel writes the timing of each command, one JSON
+    object per line, or returns None if there is no log directory
+    '''
+    logDir = os.environ.get('CODEQL_EXTRACTOR_CPP_LOG_DIR')
+    if logDir is None or not os.path.isdir(logDir):
+        return None
+    fn = os.path.join(logDir, 'standalone', 'timings.jsonl')
+    pathlib.Path(fn).parent.mkdir(parents=True, exist_ok=True)
+    return open(fn, 'a')
+
+
 def run_commands_in_parallel(commands, threads):
-    print('Running', len(commands), 'commands in', threads, 'threads')
+    '''
+    Run the commands, largest estimated cost first (see CostEstimator), so that a large
+    translation unit does not start last and set the wall time. At most threads commands run
+    at once, and fewer while the estimated memory of the running commands would exceed the
+    available memory; one always runs.
+
+    commands can be an iterator that produces the commands as they are read: they are taken in
+    batches of read_batch_size between launches, and the first commands start before the last
+    are read. The largest of the commands read so far is launched first.
+    '''
+    print('Running commands in', threads, 'threads')
+    commands = iter(commands)
+    more_commands = True
+    estimator = CostEstimator()
+    # Heap of (-cost, index, command): the largest cost first, and otherwise the first read
+    pending = []
+    count = 0
+    memory_budget = get_available_memory()
+    timing_log = open_timing_log()
     errors = 0
     partial = 0
     successes = 0
-    with CodeQLExecutor(max_workers=threads) as executor:
-        futures = {executor.submit(run_process_with_response_file, command): command for command in
-                   commands}
-        for future in as_completed(futures):
-            output = futures[future]
-            try:
-                future_result = future.result()
-                if future_result == 0:
-                    successes = successes + 1
-                elif future_result == -1:
-                    errors = errors + 1
-                else:
-                    # We had some errors, so the output wasn't clean.
-                    # However, we still manage to extract something, so we warn accordingly
-                    partial = partial + 1
-            except Exception as e:
-                print(f"{output}: {e}")
-                errors = errors + 1
-    print(f'Ran {len(commands)} commands [s={successes},p={partial},f={errors}]')
+    # future --> (cost, memory, command, start time)
+    running = {}
+    running_memory = 0
+    start = time.monotonic()
+    try:
+        with CodeQLExecutor(max_workers=threads) as executor:
+            while more_commands or pending or running:
+                if more_commands:
+                    read = 0
+                    for command in itertools.islice(commands, read_batch_size):
+                        heapq.heappush(pending, (-estimator.estimate(command), count, command))
+                        count += 1
+                        read += 1
+                    more_commands = read == read_batch_size
+                while pending and len(running) < threads:
+                    cost = -pending[0][0]
+                    memory = job_memory_base + job_memory_per_cost * cost
+                    if (running and memory_budget is not None
+                            and running_memory + memory > memory_budget):
+                        break
+                    command = heapq.heappop(pending)[2]
+                    running_memory += memory
+                    future = executor.submit(run_process_with_response_file, command)
+                    running[future] = (cost, memory, command, time.monotonic())
+
+                if not running:
+                    continue
+                # Keep reading while the commands run, unless everything has been read
+                done, _ = wait(running, timeout=0 if more_commands else None,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    cost, memory, output, started = running.pop(future)
+                    running_memory -= memory
+                    future_result = None
+                    try:
+                        future_result = future.result()
+                        if future_result == 0:
+                            successes = successes + 1
+                        elif future_result == -1:
+                            errors = errors + 1
+                        else:
+                            # We had some errors, so the output wasn't clean.
+                            # However, we still manage to extract something, so we warn accordingly
+                            partial = partial + 1
+                    except Exception as e:
+                        print(f"{output}: {e}")
+                        errors = errors + 1
+                    if timing_log is not None:
+                        now = time.monotonic()
+                        timing_log.write(json.dumps({
+                            'source': output.source, 'cost': cost, 'memory': memory,
+                            'start': round(started - start, 3), 'seconds': round(now - started, 3),
+                            'returncode': future_result}) + '\n')
+    finally:
+        if timing_log is not None:
+            timing_log.close()
+    print(f'Ran {count} commands [s={successes},p={partial},f={errors}]')
+
+
+def read_compile_commands(json_file):
+    '''
+    Generate the entries of a compile_commands.json file one at a time, parsing each as soon as
+    it has been read rather than reading and parsing the whole file first.
+    Raises ValueError if the file is not a JSON list of objects.
+    '''
+    decoder = json.JSONDecoder()
+    whitespace = ' \t\n\r'
+    with open(json_file, 'r') as f:
+        buffer = ''
+        pos = 0
+        # The structural character expected next: '[' to start, then ',' or ']' after an entry
+        expected = '['
+        first = True
+        while True:
+            while pos < len(buffer) and buffer[pos] in whitespace:
+                pos += 1
+            if pos == len(buffer):
+                more = f.read(read_chunk_size)
+                if not more:
+                    raise ValueError('Unexpected end of ' + json_file)
+                buffer = more
+                pos = 0
+                continue
+            c = buffer[pos]
+            if c == ']' and (expected == ',' or (expected is None and first)):
+                return
+            if expected is not None:
+                if c != expected:
+                    raise ValueError('Expected {!r} at {!r} in {}'.format(expected, c, json_file))
+                pos += 1
+                expected = None
+                continue
+            # Decode an entry, reading more of the file until it is complete
+            while True:
+                try:
+                    entry, pos = decoder.raw_decode(buffer, pos)
+                    break
+                except json.JSONDecodeError:
+                    more = f.read(read_chunk_size)
+                    if not more:
+                        raise
+                    buffer = buffer[pos:] + more
+                    pos = 0
+            if not isinstance(entry, dict):
+                raise ValueError('Not a compile command in {}: {!r}'.format(json_file, entry))
+            yield entry
+            expected = ','
+            first = False
 
 
 def run_compile_commands_json(compiler, json_file, threads):
@@ -262,13 +568,10 @@ def run_compile_commands_json(compiler, json_file, threads):
     This should be run in a traced context.
     '''
     print('Running compile commands')
-    with open(json_file, 'r') as f:
-        data = f.read()
-    compile_commands = json.loads(data)
-    compiler_invocations = []
-    for command in compile_commands:
-        compiler_invocations.append(CommandWithResponse(command['command'], compiler))
-    run_commands_in_parallel(list, threads)
+    compiler_invocations = (
+        CommandWithResponse(command['command'], compiler, command_source(command))
+        for command in read_compile_commands(json_file))
+    run_commands_in_parallel(compiler_invocations, threads)
 
 
 def extract_compile_commands_json(extractor, compiler, json_file, threads):
@@ -277,15 +580,20 @@ def extract_compile_commands_json(extractor, compiler, json_file, threads):
     for each command. This should not be run in a traced context.
     '''
     print('Extracting compile commands')
-    with open(json_file, 'r') as f:
-        data = f.read()
-    commands = json.loads(data)
-    list = []
-    for command in commands:
-        command = CommandWithResponse(command['command'], compiler)
-        command.command = [extractor, '--mimic'] + command.command
-        list.append(command)
-    run_commands_in_parallel(list, threads)
+    run_commands_in_parallel(extractor_invocations(extractor, compiler, json_file), threads)
+
+
+def extractor_invocations(extractor, compiler, json_file):
+    '''Generate the extractor invocations for the compile commands as they are read'''
+    for command in read_compile_commands(json_file):
+        invocation = CommandWithResponse(command['command'], compiler, command_source(command))
+        invocation.command = [extractor, '--mimic'] + invocation.command
+        yield invocation
+
+
+def command_source(command):
+    '''The path of the source file of an entry of compile_commands.json'''
+    return os.path.join(command.get('directory', ''), command['file'])
 
 
 class ClangCompiler:
@@ -306,6 +614,10 @@ class ClangCompiler:
     def include(self, inc):
         return '-I' + str(inc)
 
+    def include_dir(self, arg):
+        '''The include directory of an argument built by include, or None for other arguments'''
+        return arg[2:] if arg.startswith('-I') and len(arg) > 2 else None
+
     def output(self, out):
         return ['-o', out]
 
@@ -333,6 +645,10 @@ class MsvcCompiler:
     def include(self, inc):
         return '/I' + str(inc)
 
+    def include_dir(self, arg):
+        '''The include directory of an argument built by include, or None for other arguments'''
+        return arg[2:] if arg.startswith('/I') and len(arg) > 2 else None
+
     def output(self, out):
         return ['/Fo' + out]
 
@@ -377,6 +693,26 @@ def verbose_output():
     return os.environ.get('CODEQL_EXTRACTOR_CPP_BUILD_MODE_NONE_VERBOSE', 'false') == 'true'
 
 
+def cache_dir():
+    '''
+    The directory in which build mode none keeps what it learns about files between runs: the
+    includes of each file, the indexes of the system include directories and the default include
+    directories of compilers. Entries are checked against the files they describe before use.
+    Defaults to a directory in the user's cache directory; an empty
+    CODEQL_EXTRACTOR_CPP_BUILD_MODE_NONE_CACHE_DIR disables the cache.
+    '''
+    d = os.environ.get('CODEQL_EXTRACTOR_CPP_BUILD_MODE_NONE_CACHE_DIR')
+    if d is not None:
+        return d or None
+    if os.name == 'nt':
+        cache_home = os.environ.get('LOCALAPPDATA')
+    else:
+        cache_home = os.environ.get('XDG_CACHE_HOME')
+    if not cache_home:
+        cache_home = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'codeql', 'cpp-build-mode-none')
+
+
 def resolve_dependencies():
     return os.environ.get('CODEQL_EXTRACTOR_CPP_BUILD_MODE_NONE_DEPENDENCIES_FROM_SYSTEM_INCLUDES',
                           'true') == 'true'
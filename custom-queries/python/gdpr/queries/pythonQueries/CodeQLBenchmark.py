@@ -0,0 +1,153 @@
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from CodeQLCli import GDPR_QUERIES, find_codeql, git_commit
+from CodeQLDatabaseCache import DatabaseCache
+from CodeQLEvaluatorLog import parse_logs, rank, select_query_predicates
+
+SIZES = [1000, 10000, 100000, 1000000]
+LINES_PER_MODULE = 500
+MODULES_PER_PACKAGE = 100
+
+
+def load_idioms(directory="test-code"):
+    idioms = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".py"):
+            with open(os.path.join(directory, filename), "r", encoding="utf-8") as f:
+                lines = [line.rstrip() for line in f]
+            if any(lines):
+                idioms.append((os.path.splitext(filename)[0], lines))
+    return idioms
+
+
+def generate_corpus(target, loc, idioms):
+    # Each idiom becomes the body of its own function, so modules can hold many of them.
+    # The output only depends on `loc` and the idioms, so the database cache can reuse it.
+    os.makedirs(target, exist_ok=True)
+    written = 0
+    module = 0
+    function = 0
+    while written < loc:
+        package = os.path.join(target, "pkg%04d" % (module // MODULES_PER_PACKAGE))
+        os.makedirs(package, exist_ok=True)
+        out = []
+        module_loc = 0
+        while module_loc < LINES_PER_MODULE and written + module_loc < loc:
+            name, lines = idioms[function % len(idioms)]
+            out.append(f"def {name}_{function}():")
+            out += ["    " + line if line else "" for line in lines]
+            out.append("")
+            module_loc += 1 + sum(1 for line in lines if line.strip())
+            function += 1
+        with open(os.path.join(package, "module%04d.py" % module), "w", encoding="utf-8") as f:
+            f.write("\n".join(out))
+        written += module_loc
+        module += 1
+    return written, module
+
+
+def run_measured(cmd):
+    # Returns (wall seconds, peak RSS in MB of the process tree or None)
+    # stderr goes to a file: the CLI's progress output could fill a pipe while we wait
+    stderr = tempfile.TemporaryFile()
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=stderr)
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        peak = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    else:
+        process.wait()
+        elapsed = time.perf_counter() - start
+        peak = None
+    stderr.seek(0)
+    output = stderr.read().decode("utf-8", errors="replace")
+    stderr.close()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stderr=output)
+    return elapsed, peak
+
+
+def benchmark_size(cache, codeql, workdir, loc, idioms, queries, threads, ram, top):
+    corpus = os.path.join(workdir, "corpus-%d" % loc)
+    actual_loc, modules = generate_corpus(corpus, loc, idioms)
+
+    start = time.perf_counter()
+    misses = cache.misses
+    database = cache.get_database(corpus, threads=threads)
+    build_seconds = time.perf_counter() - start
+    cached = cache.misses == misses
+
+    result = {"loc": actual_loc, "modules": modules, "cached_database": cached,
+              "build_seconds": round(build_seconds, 3), "queries": []}
+    try:
+        for query in queries:
+            evaluator_log = os.path.join(workdir, "evaluator-%d.json" % loc)
+            cmd = [codeql, "query", "run", "--database=" + database,
+                   "--threads=%d" % threads, "--ram=%d" % ram,
+                   "--evaluator-log=" + evaluator_log,
+                   "--output=" + os.path.join(workdir, "results-%d.bqrs" % loc), query]
+            seconds, peak = run_measured(cmd)
+            predicates = select_query_predicates(parse_logs([evaluator_log]), query)
+            result["queries"].append({
+                "query": os.path.basename(query),
+                "wall_seconds": round(seconds, 3),
+                "peak_rss_mb": round(peak, 1) if peak is not None else None,
+                "predicates": {s.name: {"millis": s.millis, "tuples": s.tuples,
+                                        "result_size": s.result_size}
+                               for s in rank(predicates)[:top]},
+            })
+            print(f"{actual_loc:>8} LOC  {os.path.basename(query)}: {seconds:.1f}s"
+                  + (f", peak {peak:.0f} MB" if peak is not None else ""))
+    finally:
+        cache.release(database)
+    return result
+
+
+def append_trend(trend_file, run):
+    trend = []
+    if os.path.exists(trend_file):
+        with open(trend_file, "r", encoding="utf-8") as f:
+            trend = json.load(f)
+    trend.append(run)
+    with open(trend_file, "w", encoding="utf-8") as f:
+        json.dump(trend, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the GDPR queries on growing corpora.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Lines of code")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--ram", type=int, default=4096, help="MB")
+    parser.add_argument("--query", action="append", help="Defaults to SensitiveData.ql")
+    parser.add_argument("--idioms", default="test-code")
+    parser.add_argument("--top", type=int, default=20, help="Predicates recorded per run")
+    parser.add_argument("--trend-file", default="benchmark-trend.json")
+    parser.add_argument("--workdir", default=None)
+    args = parser.parse_args()
+
+    codeql = find_codeql()
+    cache = DatabaseCache(codeql=codeql)
+    idioms = load_idioms(args.idioms)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="gdpr-benchmark-")
+    run = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "cli_version": cache.version,
+        "threads": args.threads,
+        "ram_mb": args.ram,
+        "results": [benchmark_size(cache, codeql, workdir, loc, idioms, args.query or GDPR_QUERIES,
+                                   args.threads, args.ram, args.top)
+                    for loc in args.sizes],
+    }
+    append_trend(args.trend_file, run)
+    print(f"Appended results to {args.trend_file}")
@@ -0,0 +1,101 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+
+# Paths relative to the repository root, matching the commands in the README
+BUNDLED_CODEQL = os.path.join("codeql", "codeql.exe" if os.name == "nt" else "codeql")
+GDPR_QUERIES = [os.path.join("custom-queries", "python", "gdpr", "queries", "SensitiveData.ql")]
+GDPR_PACK = os.path.join("custom-queries", "python", "gdpr")
+
+
+def find_codeql():
+    # An explicit CODEQL setting wins, then the CLI on PATH, then the bundled one
+    codeql = os.environ.get("CODEQL")
+    if codeql:
+        return codeql
+    codeql = shutil.which("codeql")
+    if codeql:
+        return codeql
+    if os.path.isfile(BUNDLED_CODEQL):
+        return os.path.abspath(BUNDLED_CODEQL)
+    raise FileNotFoundError("No CodeQL CLI found. Set CODEQL or add codeql to PATH.")
+
+
+def run_codeql(args, codeql=None, **kwargs):
+    cmd = [codeql or find_codeql()] + list(args)
+    return subprocess.run(cmd, check=True, capture_output=True, text=True, **kwargs)
+
+
+def cli_version(codeql=None):
+    return run_codeql(["version", "--format=terse"], codeql).stdout.strip()
+
+
+def git_commit():
+    # The checked-out commit of the working directory, or None outside a git repository
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class CliServer:
+    # A long-lived `codeql execute cli-server` process. Each command is sent as a
+    # JSON array of arguments terminated by a NUL byte, and its output is read back
+    # up to the next NUL byte, so only the first command pays for JVM startup.
+
+    def __init__(self, codeql=None, logdir=None):
+        self.codeql = codeql or find_codeql()
+        args = [self.codeql, "execute", "cli-server"]
+        if logdir:
+            args.append("--logdir=" + logdir)
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+        self.stderr = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self._drain_stderr, daemon=True).start()
+
+    def _drain_stderr(self):
+        for line in self.process.stderr:
+            self.stderr.append(line.decode("utf-8", errors="replace"))
+            del self.stderr[:-200]
+
+    def run(self, args):
+        with self.lock:
+            if self.process.poll() is not None:
+                raise RuntimeError("CodeQL cli-server exited:\n" + "".join(self.stderr))
+            self.stderr.clear()
+            self.process.stdin.write(json.dumps(list(args)).encode("utf-8") + b"\0")
+            self.process.stdin.flush()
+            output = bytearray()
+            while True:
+                chunk = self.process.stdout.read1(65536)
+                if not chunk:
+                    raise RuntimeError("CodeQL cli-server exited:\n" + "".join(self.stderr))
+                end = chunk.find(b"\0")
+                if end >= 0:
+                    output += chunk[:end]
+                    break
+                output += chunk
+            return output.decode("utf-8")
+
+    def run_json(self, args):
+        return json.loads(self.run(list(args) + ["--format=json"]))
+
+    def close(self):
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write(json.dumps(["shutdown"]).encode("utf-8") + b"\0")
+                self.process.stdin.close()
+                self.process.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,267 @@
+import argparse
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from CodeQLCli import cli_version, find_codeql, run_codeql
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "GDPR_DB_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "gdpr-analyzer", "databases"))
+DEFAULT_MAX_BYTES = int(os.environ.get("GDPR_DB_CACHE_MAX_BYTES", 10 * 1024 ** 3))
+
+# Never part of the analyzed source: stale databases, bytecode and VCS metadata
+DEFAULT_EXCLUDES = ["python-db", "**/__pycache__", "**/*.pyc", ".git"]
+
+LAST_USED = ".last-used"
+# Size in bytes of a cached database, recorded when it is built and when it is released
+SIZE = ".size"
+
+
+def glob_regex(pattern):
+    # `*` stays within one path segment and `**` spans segments, as in code scanning configs
+    result = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            result += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("**", i):
+            result += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            result += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            result += "[^/]"
+            i += 1
+        else:
+            result += re.escape(pattern[i])
+            i += 1
+    return result
+
+
+def compile_patterns(patterns):
+    # A pattern matches a path if it matches the path itself or one of its parent directories
+    if not patterns:
+        return re.compile("(?!)")
+    alternatives = "|".join(glob_regex(p.strip("/")) for p in patterns)
+    return re.compile("(?:" + alternatives + ")(?:/.*)?\\Z", re.DOTALL)
+
+
+def iter_source_files(source_root, excludes=DEFAULT_EXCLUDES, paths=None):
+    # Yields (relative posix path, absolute path) in a stable order. If `paths` is given,
+    # only files matching one of its patterns (or below a matching directory) are included.
+    excluded = compile_patterns(excludes)
+    included = compile_patterns(paths) if paths is not None else None
+    for root, dirs, files in os.walk(source_root):
+        rel_root = os.path.relpath(root, source_root).replace(os.sep, "/")
+        rel_root = "" if rel_root == "." else rel_root + "/"
+        dirs[:] = sorted(d for d in dirs if not excluded.match(rel_root + d))
+        for filename in sorted(files):
+            rel_path = rel_root + filename
+            if excluded.match(rel_path):
+                continue
+            if included is not None and not included.match(rel_path):
+                continue
+            yield rel_path, os.path.join(root, filename)
+
+
+def source_tree_hash(source_root, version, language="python", excludes=DEFAULT_EXCLUDES,
+                     paths=None):
+    digest = hashlib.sha256()
+    digest.update(f"{version}\0{language}\0{sorted(excludes)}\0".encode("utf-8"))
+    if paths is not None:
+        digest.update(f"{sorted(paths)}\0".encode("utf-8"))
+    for rel_path, full_path in iter_source_files(source_root, excludes, paths):
+        digest.update(rel_path.encode("utf-8") + b"\0")
+        with open(full_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def is_finalised(database):
+    try:
+        with open(os.path.join(database, "codeql-database.yml"), "r", encoding="utf-8") as f:
+            return any(line.strip() == "finalised: true" for line in f)
+    except OSError:
+        return False
+
+
+def dir_size(path):
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for filename in files:
+            try:
+                total += os.lstat(os.path.join(root, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def write_codescanning_config(path, paths=None, paths_ignore=None):
+    # Minimal YAML writer for the `paths` and `paths-ignore` keys of a code scanning config
+    if paths is not None and not paths:
+        # Without a `paths` key CodeQL extracts the whole tree, not nothing
+        raise ValueError("No paths to extract: an empty `paths` list would include every file")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("name: gdpr-analyzer\n")
+        for key, values in (("paths", paths), ("paths-ignore", paths_ignore)):
+            if values:
+                f.write(key + ":\n")
+                for value in values:
+                    f.write("  - '" + value.replace("'", "''") + "'\n")
+
+
+class DatabaseCache:
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, codeql=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.codeql = codeql or find_codeql()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        # Databases handed out and not yet released, with how many times they are held.
+        # They are never evicted while held.
+        self.in_use = {}
+        # Guards the counters, in_use and eviction, as shards share one cache across threads
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def version(self):
+        if self._version is None:
+            self._version = cli_version(self.codeql)
+        return self._version
+
+    def touch(self, entry):
+        with open(os.path.join(entry, LAST_USED), "w") as f:
+            f.write("")
+
+    def record_size(self, entry):
+        # Measures one database, so that eviction does not have to walk every cached one
+        size = dir_size(entry)
+        with open(os.path.join(entry, SIZE), "w") as f:
+            f.write(str(size))
+        return size
+
+    def get_database(self, source_root, language="python", excludes=DEFAULT_EXCLUDES, threads=0,
+                     paths=None, ram=None):
+        # Returns the path of a finalized database for the source tree, building it on a miss.
+        # `paths` restricts extraction to part of the tree, as in a code scanning config.
+        # The database is held until it is passed to release.
+        key = source_tree_hash(source_root, self.version, language, excludes, paths)
+        entry = os.path.join(self.cache_dir, key)
+        with self.lock:
+            # Claimed before the build, so a concurrent eviction cannot remove it once built
+            self.in_use[entry] = self.in_use.get(entry, 0) + 1
+            hit = is_finalised(entry)
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        try:
+            if hit:
+                print(f"Reusing cached database {entry}")
+            else:
+                self.build(source_root, entry, language, excludes, threads, paths, ram)
+                self.record_size(entry)
+            self.touch(entry)
+        except BaseException:
+            self.release(entry)
+            raise
+        if not hit:
+            # Only a new database can take the cache over its size limit
+            self.evict()
+        return entry
+
+    def release(self, entry):
+        # Lets a database returned by get_database be evicted again. Its size is measured
+        # anew, as query evaluation grows the database's cache.
+        with self.lock:
+            count = self.in_use.get(entry, 0) - 1
+            if count > 0:
+                self.in_use[entry] = count
+            else:
+                self.in_use.pop(entry, None)
+        if is_finalised(entry):
+            self.record_size(entry)
+
+    def build(self, source_root, entry, language, excludes, threads, paths=None, ram=None):
+        staging = tempfile.mkdtemp(prefix=os.path.basename(entry) + ".", dir=self.cache_dir)
+        try:
+            config = os.path.join(staging, "codeql-config.yml")
+            write_codescanning_config(config, paths=paths, paths_ignore=excludes)
+            database = os.path.join(staging, "db")
+            print(f"Creating database for {source_root} in {entry}")
+            args = ["database", "create", database, "--language=" + language,
+                    "--source-root=" + os.path.abspath(source_root),
+                    "--codescanning-config=" + config, "--threads=%d" % threads, "--overwrite"]
+            if ram:
+                args.append("--ram=%d" % ram)
+            run_codeql(args, self.codeql)
+            if os.path.isdir(entry) and not is_finalised(entry):
+                # A partial entry left behind by an interrupted build
+                shutil.rmtree(entry)
+            try:
+                os.replace(database, entry)
+            except OSError:
+                # Another build of the same tree finished first; use that one
+                if not is_finalised(entry):
+                    raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def entries(self):
+        # Returns [(last used, size, path)] for all cached databases, least recently used first
+        result = []
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(entry) or "." in name:
+                continue
+            try:
+                last_used = os.path.getmtime(os.path.join(entry, LAST_USED))
+            except OSError:
+                last_used = 0
+            try:
+                with open(os.path.join(entry, SIZE), "r") as f:
+                    size = int(f.read())
+            except (OSError, ValueError):
+                # A database cached before sizes were recorded
+                size = self.record_size(entry)
+            result.append((last_used, size, entry))
+        return sorted(result)
+
+    def evict(self):
+        with self.lock:
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                if entry in self.in_use:
+                    continue
+                print(f"Evicting cached database {entry} ({size} bytes)")
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or reuse a cached CodeQL database.")
+    parser.add_argument("source_root", nargs="?", default="test-code")
+    parser.add_argument("--language", default="python")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES)
+    parser.add_argument("--exclude", action="append", default=[],
+                        help="Extra glob of source paths to leave out (relative to the source root)")
+    args = parser.parse_args()
+    cache = DatabaseCache(args.cache_dir, args.max_bytes)
+    database = cache.get_database(args.source_root, args.language,
+                                  DEFAULT_EXCLUDES + args.exclude)
+    cache.release(database)
+    print(database)
@@ -0,0 +1,263 @@
+import argparse
+import json
+import os
+import re
+
+from CodeQLCli import GDPR_QUERIES
+
+# Text logs (query-run-*.log, execute-queries-*.log)
+EVALUATED_PATTERN = re.compile(
+    r"Evaluated (?:non-recursive |recursive )?predicate (\S+) in (\d+)ms \(size: (\d+)\)")
+TUPLE_COUNTS_PATTERN = re.compile(
+    r"(?:Tuple counts for (\S+?)(?: after (\d+)ms)?:"
+    r"|Evaluated relational algebra for predicate (\S+) with tuple counts:)\s*$")
+RA_STEP_PATTERN = re.compile(r"^\s*(\d+)\s+~\d+%\s+(.*\S)")
+LOG_PREFIX_PATTERN = re.compile(r"^\[[^\]]*\]\s*(?:\([^)]*\)\s*)?")
+
+# Hash and binding-set suffixes differ between runs of the same query text
+PREDICATE_HASH_PATTERN = re.compile(r"(#[0-9a-f]{8,}|@[0-9a-z]{6,})")
+QL_PREDICATE_PATTERN = re.compile(r"^\s*(?:private\s+)?predicate\s+(\w+)\s*\(", re.MULTILINE)
+
+# A pipeline step producing this many more tuples than the predicate's result is suspect
+CARTESIAN_FACTOR = 100
+CARTESIAN_MIN_TUPLES = 10000
+
+
+class PredicateStats:
+
+    def __init__(self, name):
+        self.name = name
+        self.millis = 0
+        self.result_size = 0
+        self.evaluations = 0
+        # [(tuple count, RA step)] of the most expensive pipeline run seen
+        self.steps = []
+
+    @property
+    def tuples(self):
+        return sum(count for count, _ in self.steps)
+
+    def add(self, millis, result_size):
+        self.millis += millis
+        self.evaluations += 1
+        self.result_size = max(self.result_size, result_size or 0)
+
+    def add_steps(self, steps):
+        if steps and sum(count for count, _ in steps) >= self.tuples:
+            self.steps = steps
+
+    def cartesian_steps(self, factor=CARTESIAN_FACTOR, min_tuples=CARTESIAN_MIN_TUPLES):
+        flagged = []
+        for count, step in self.steps:
+            if "CARTESIAN PRODUCT" in step or (
+                    count >= min_tuples and count >= factor * max(self.result_size, 1)):
+                flagged.append((count, step))
+        return flagged
+
+
+def predicate_key(name):
+    return PREDICATE_HASH_PATTERN.sub("", name)
+
+
+def iter_json_objects(text):
+    # Evaluator logs are a sequence of JSON objects separated by whitespace
+    decoder = json.JSONDecoder()
+    pos = 0
+    while True:
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        if pos >= len(text):
+            return
+        obj, pos = decoder.raw_decode(text, pos)
+        yield obj
+
+
+def parse_json_log(text, stats):
+    started = {}
+    pipeline_starts = {}
+    steps_by_predicate = {}
+    for event in iter_json_objects(text):
+        if "type" not in event:
+            # `codeql generate log-summary` output: one object per predicate evaluation
+            name = event.get("predicateName")
+            if name is None:
+                continue
+            runs = event.get("pipelineRuns") or [{"raReference": "pipeline",
+                                                   "counts": event.get("counts", [])}]
+            steps = []
+            for run in runs:
+                ra = (event.get("ra") or {}).get(run.get("raReference"), [])
+                steps += [(count, step.strip()) for count, step in zip(run.get("counts", []), ra)]
+            predicate = stats_for(stats, name)
+            predicate.add(event.get("millis", 0), event.get("resultSize"))
+            predicate.add_steps(steps)
+            continue
+        # Raw `--evaluator-log` events
+        kind = event["type"]
+        if kind == "PREDICATE_STARTED":
+            started[event["eventId"]] = event
+            steps_by_predicate[event["eventId"]] = []
+        elif kind == "PIPELINE_STARTED":
+            pipeline_starts[event["eventId"]] = event
+        elif kind == "PIPELINE_COMPLETED":
+            pipeline = pipeline_starts.pop(event.get("startEvent"), None)
+            if pipeline is None:
+                continue
+            predicate = started.get(pipeline.get("predicateStartEvent"))
+            if predicate is None:
+                continue
+            ra = (predicate.get("ra") or {}).get(pipeline.get("raReference"), [])
+            steps = [(count, step.strip()) for count, step in zip(event.get("counts", []), ra)]
+            steps_by_predicate[pipeline["predicateStartEvent"]] += steps
+        elif kind == "PREDICATE_COMPLETED":
+            predicate = started.pop(event.get("startEvent"), None)
+            if predicate is None:
+                continue
+            millis = (event.get("nanoTime", 0) - predicate.get("nanoTime", 0)) // 1000000
+            s = stats_for(stats, predicate["predicateName"])
+            s.add(millis, event.get("resultSize"))
+            s.add_steps(steps_by_predicate.pop(predicate["eventId"], []))
+
+
+def parse_text_log(lines, stats):
+    current = None
+    steps = []
+    for line in lines:
+        line = LOG_PREFIX_PATTERN.sub("", line.rstrip("\n"))
+        if current is not None:
+            m = RA_STEP_PATTERN.match(line)
+            if m:
+                steps.append((int(m.group(1)), m.group(2)))
+                continue
+            if line.strip() == "":
+                continue
+            # End of the tuple count block
+            stats_for(stats, current).add_steps(steps)
+            current = None
+        m = TUPLE_COUNTS_PATTERN.search(line)
+        if m:
+            current = m.group(1) or m.group(3)
+            steps = []
+            continue
+        m = EVALUATED_PATTERN.search(line)
+        if m:
+            stats_for(stats, m.group(1)).add(int(m.group(2)), int(m.group(3)))
+    if current is not None:
+        stats_for(stats, current).add_steps(steps)
+
+
+def stats_for(stats, name):
+    key = predicate_key(name)
+    if key not in stats:
+        stats[key] = PredicateStats(name)
+    return stats[key]
+
+
+def parse_logs(paths):
+    # Accepts log files and directories of logs; returns {predicate key: PredicateStats}
+    stats = {}
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _dirs, names in os.walk(path):
+                files += [os.path.join(root, n) for n in sorted(names)
+                          if n.endswith((".log", ".json", ".jsonl"))]
+        else:
+            files.append(path)
+    for filename in files:
+        with open(filename, "r", encoding="utf-8", errors="replace") as f:
+            text = f.read()
+        if text.lstrip().startswith("{"):
+            parse_json_log(text, stats)
+        else:
+            parse_text_log(text.splitlines(), stats)
+    return stats
+
+
+def query_predicates(query_file):
+    with open(query_file, "r", encoding="utf-8") as f:
+        return set(QL_PREDICATE_PATTERN.findall(f.read()))
+
+
+def select_query_predicates(stats, query_file):
+    # Keep the predicates defined in the query file and its select clause
+    module = os.path.splitext(os.path.basename(query_file))[0]
+    names = query_predicates(query_file)
+    selected = {}
+    for key, s in stats.items():
+        base = re.split(r"[#/@]", key.split("::")[-1])[0]
+        if key.startswith(module + "::") or key.startswith("#select") or base in names:
+            selected[key] = s
+    return selected
+
+
+SORT_KEYS = {
+    "time": lambda s: s.millis,
+    "tuples": lambda s: s.tuples,
+    "steps": lambda s: len(s.steps),
+}
+
+
+def rank(stats, sort="time"):
+    return sorted(stats.values(), key=SORT_KEYS[sort], reverse=True)
+
+
+def diff(before, after):
+    # Returns [(key, before stats or None, after stats or None)], largest time change first
+    rows = []
+    for key in set(before) | set(after):
+        rows.append((key, before.get(key), after.get(key)))
+
+    def change(row):
+        old = row[1].millis if row[1] else 0
+        new = row[2].millis if row[2] else 0
+        return abs(new - old)
+    return sorted(rows, key=change, reverse=True)
+
+
+def print_ranking(stats, sort, top, factor, min_tuples):
+    print(f"{'time(ms)':>9} {'evals':>5} {'size':>9} {'tuples':>11} {'steps':>5}  predicate")
+    for s in rank(stats, sort)[:top]:
+        print(f"{s.millis:>9} {s.evaluations:>5} {s.result_size:>9} {s.tuples:>11} "
+              f"{len(s.steps):>5}  {s.name}")
+    for s in rank(stats, "tuples"):
+        for count, step in s.cartesian_steps(factor, min_tuples):
+            print(f"[!] Possible cartesian product in {s.name}: {count} tuples "
+                  f"(result size {s.result_size}): {step}")
+
+
+def print_diff(before, after, top):
+    print(f"{'before(ms)':>10} {'after(ms)':>10} {'delta':>8} {'tuples delta':>13}  predicate")
+    for key, old, new in diff(before, after)[:top]:
+        old_ms, new_ms = (old.millis if old else 0), (new.millis if new else 0)
+        old_tuples, new_tuples = (old.tuples if old else 0), (new.tuples if new else 0)
+        status = "" if old and new else (" (added)" if new else " (removed)")
+        print(f"{old_ms:>10} {new_ms:>10} {new_ms - old_ms:>+8} {new_tuples - old_tuples:>+13}  "
+              f"{key}{status}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize CodeQL evaluator logs per predicate.")
+    parser.add_argument("logs", nargs="+", help="Log files or directories of logs")
+    parser.add_argument("--diff", nargs="+", metavar="LOG",
+                        help="Logs of an earlier run to compare against (shown as before)")
+    parser.add_argument("--sort", choices=sorted(SORT_KEYS), default="time")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--query", default=GDPR_QUERIES[0])
+    parser.add_argument("--all", action="store_true",
+                        help="Include library predicates, not only those of the query")
+    parser.add_argument("--cartesian-factor", type=int, default=CARTESIAN_FACTOR)
+    parser.add_argument("--cartesian-min-tuples", type=int, default=CARTESIAN_MIN_TUPLES)
+    args = parser.parse_args()
+
+    stats = parse_logs(args.logs)
+    if not args.all:
+        stats = select_query_predicates(stats, args.query)
+    if args.diff:
+        other = parse_logs(args.diff)
+        if not args.all:
+            other = select_query_predicates(other, args.query)
+        # The --diff logs are the earlier run the positional logs are compared against
+        print_diff(other, stats, args.top)
+    else:
+        print_ranking(stats, args.sort, args.top, args.cartesian_factor, args.cartesian_min_tuples)
@@ -0,0 +1,176 @@
+import argparse
+import ast
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+from CodeQLCli import GDPR_QUERIES, find_codeql, run_codeql
+from CodeQLDatabaseCache import (DEFAULT_EXCLUDES, DatabaseCache, iter_source_files,
+                                 write_codescanning_config)
+from CodeQLSharding import result_key
+from PythonQueryGeneral import SENSITIVE_VARS, analyze_file
+
+# Every SensitiveData.ql predicate requires a Name whose id is one of the sensitive variables,
+# so a file without any of them as a whole word cannot produce a CodeQL result
+SENSITIVE_ANCHOR = re.compile(
+    rb"\b(?:" + b"|".join(re.escape(v.encode("ascii")) for v in sorted(SENSITIVE_VARS)) + rb")\b")
+IMPORT_PATTERN = re.compile(
+    r"^\s*(?:from\s+(\.*[\w.]*)\s+import\s+([\w., ]+)|import\s+([\w., ]+))", re.MULTILINE)
+
+
+def has_anchor(path):
+    with open(path, "rb") as f:
+        return SENSITIVE_ANCHOR.search(f.read()) is not None
+
+
+def has_findings(path):
+    try:
+        return has_anchor(path) and bool(analyze_file(path))
+    except UnicodeDecodeError:
+        # The scanners only read UTF-8; leave the decision to CodeQL
+        return True
+
+
+def imported_modules(source):
+    # Returns [(level, module, names)] of all import statements
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        imports = []
+        for m in IMPORT_PATTERN.finditer(source):
+            if m.group(3):
+                imports += [(0, name.split(" as ")[0].strip(), []) for name in m.group(3).split(",")]
+            else:
+                module = m.group(1)
+                level = len(module) - len(module.lstrip("."))
+                names = [n.split(" as ")[0].strip() for n in m.group(2).split(",")]
+                imports.append((level, module.lstrip("."), names))
+        return imports
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports += [(0, alias.name, []) for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            imports.append((node.level, node.module or "", [alias.name for alias in node.names]))
+    return imports
+
+
+def resolve_import(rel_path, level, module, names, files):
+    # Map an import to the source files (relative posix paths) it can load
+    if level:
+        base = os.path.dirname(rel_path).split("/") if os.path.dirname(rel_path) else []
+        base = base[:len(base) - (level - 1)] if level > 1 else base
+        bases = ["/".join(base)]
+    else:
+        # Absolute imports from the source root, or from the script's own directory
+        bases = ["", os.path.dirname(rel_path)]
+    resolved = set()
+    for base in bases:
+        parts = (base.split("/") if base else []) + (module.split(".") if module else [])
+        candidates = []
+        # Every package on the way is imported too
+        for i in range(1, len(parts) + 1):
+            candidates.append("/".join(parts[:i]) + "/__init__.py")
+        if parts:
+            candidates.append("/".join(parts) + ".py")
+        for name in names:
+            candidates.append("/".join(parts + [name]) + ".py")
+            candidates.append("/".join(parts + [name, "__init__.py"]))
+        resolved.update(c for c in candidates if c in files)
+    return resolved
+
+
+def candidate_files(source_root, mode="anchor", excludes=DEFAULT_EXCLUDES):
+    # Returns (candidate files, all source files), both as sets of relative posix paths
+    files = {rel: full for rel, full in iter_source_files(source_root, excludes)
+             if rel.endswith(".py")}
+    check = has_anchor if mode == "anchor" else has_findings
+    candidates = {rel for rel, full in files.items() if check(full)}
+
+    # Add the import closure, so the analysis still sees the definitions the candidates use
+    pending = list(candidates)
+    while pending:
+        rel = pending.pop()
+        with open(files[rel], "r", encoding="utf-8", errors="replace") as f:
+            source = f.read()
+        for level, module, names in imported_modules(source):
+            for dependency in resolve_import(rel, level, module, names, files):
+                if dependency not in candidates:
+                    candidates.add(dependency)
+                    pending.append(dependency)
+    return candidates, set(files)
+
+
+def analyze(cache, source_root, paths, queries, workdir, name):
+    start = time.perf_counter()
+    database = cache.get_database(source_root, paths=paths)
+    build_seconds = time.perf_counter() - start
+    sarif = os.path.join(workdir, name + ".sarif")
+    start = time.perf_counter()
+    try:
+        run_codeql(["database", "analyze", database] + queries
+                   + ["--format=sarif-latest", "--output=" + sarif], cache.codeql)
+    finally:
+        cache.release(database)
+    analyze_seconds = time.perf_counter() - start
+    with open(sarif, "r", encoding="utf-8") as f:
+        results = {result_key(r) for run in json.load(f)["runs"] for r in run.get("results", [])}
+    return build_seconds, analyze_seconds, results
+
+
+def measure(source_root, paths, queries=None):
+    # Build and analyze the full and the narrowed tree from scratch and compare them
+    if not paths:
+        print("No candidate files: nothing to compare against a full build")
+        return
+    queries = [os.path.abspath(q) for q in (queries or GDPR_QUERIES)]
+    workdir = tempfile.mkdtemp(prefix="gdpr-prepass-")
+    cache = DatabaseCache(cache_dir=os.path.join(workdir, "databases"), codeql=find_codeql())
+    full = analyze(cache, source_root, None, queries, workdir, "full")
+    narrow = analyze(cache, source_root, sorted(paths), queries, workdir, "narrow")
+    full_seconds, narrow_seconds = full[0] + full[1], narrow[0] + narrow[1]
+    found = len(full[2] & narrow[2])
+    print(f"Full build:     {full[0]:.1f}s create + {full[1]:.1f}s analyze, "
+          f"{len(full[2])} results")
+    print(f"Narrowed build: {narrow[0]:.1f}s create + {narrow[1]:.1f}s analyze, "
+          f"{len(narrow[2])} results")
+    print(f"Speedup {full_seconds / max(narrow_seconds, 1e-9):.2f}x, "
+          f"recall {found}/{len(full[2])}")
+    for key in sorted(full[2] - narrow[2], key=str):
+        print(f"  [!] Missed: {key[-1]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Select the files that can contain leaks before building a CodeQL database.")
+    parser.add_argument("source_root", nargs="?", default="test-code")
+    parser.add_argument("--mode", choices=["anchor", "scanners"], default="anchor",
+                        help="anchor: any sensitive identifier; scanners: any Python scanner finding")
+    parser.add_argument("--config", help="Write a code scanning config with these paths")
+    parser.add_argument("--list", help="Write the file list, one path per line")
+    parser.add_argument("--measure", action="store_true",
+                        help="Compare time and results against a full build")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    candidates, all_files = candidate_files(args.source_root, args.mode)
+    print(f"Selected {len(candidates)} of {len(all_files)} files "
+          f"in {time.perf_counter() - start:.2f}s")
+    if not candidates:
+        # An empty `paths` list would make CodeQL extract the whole tree instead
+        print("No candidate files: skipping the CodeQL build")
+    if args.config and candidates:
+        write_codescanning_config(args.config, paths=sorted(candidates),
+                                  paths_ignore=DEFAULT_EXCLUDES)
+        print(f"Written {args.config}")
+    if args.list:
+        with open(args.list, "w", encoding="utf-8") as f:
+            f.writelines(path + "\n" for path in sorted(candidates))
+        print(f"Written {args.list}")
+    if args.measure:
+        measure(args.source_root, candidates)
+    if args.config and not candidates:
+        sys.exit(f"Not written {args.config}: there are no candidate files to restrict it to")
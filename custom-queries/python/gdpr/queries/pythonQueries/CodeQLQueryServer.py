@@ -0,0 +1,193 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from CodeQLCli import GDPR_PACK, GDPR_QUERIES, CliServer, find_codeql
+from CodeQLResources import tune
+
+# Result types reported by `evaluation/runQuery`
+QUERY_RESULT_TYPES = {
+    0: "SUCCESS",
+    1: "COMPILATION_ERROR",
+    2: "OTHER_ERROR",
+    3: "OOM",
+    4: "TIMEOUT",
+    5: "CANCELLATION",
+    6: "DBSCHEME_MIGRATION_REQUIRED",
+    7: "DBSCHEME_NO_UPGRADE",
+}
+
+
+class QueryServerError(RuntimeError):
+    pass
+
+
+class JsonRpcConnection:
+    # JSON-RPC 2.0 over a pipe pair, framed with Content-Length headers
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def _send(self, message):
+        body = json.dumps(message).encode("utf-8")
+        self.writer.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+        self.writer.flush()
+
+    def _receive(self):
+        length = None
+        while True:
+            header = self.reader.readline()
+            if not header:
+                raise EOFError("Query server closed the connection")
+            header = header.strip()
+            if not header:
+                break
+            name, _, value = header.decode("ascii").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        return json.loads(self.reader.read(length))
+
+    def request(self, method, params, on_notification=None):
+        with self.lock:
+            request_id = self.next_id
+            self.next_id += 1
+            self._send({"jsonrpc": "2.0", "id": request_id, "method": method, "params": params})
+            while True:
+                message = self._receive()
+                if message.get("id") != request_id or "method" in message:
+                    # Progress updates and other notifications
+                    if on_notification is not None and "method" in message:
+                        on_notification(message["method"], message.get("params"))
+                    continue
+                if "error" in message:
+                    raise QueryServerError(message["error"].get("message", str(message["error"])))
+                return message.get("result")
+
+
+class QueryServer:
+    # One long-lived `codeql execute query-server2` process. The server keeps compiled
+    # query plans and the evaluation caches of registered databases between runs, so
+    # only the first evaluation of a query pays for JVM startup and compilation.
+
+    def __init__(self, codeql=None, threads=1, ram_args=None, additional_packs=None,
+                 logdir=None, verbose=False):
+        self.codeql = codeql or find_codeql()
+        self.verbose = verbose
+        self.workdir = tempfile.mkdtemp(prefix="gdpr-query-server-")
+        self.logdir = logdir or os.path.join(self.workdir, "log")
+        self.additional_packs = [os.path.abspath(p) for p in (additional_packs or [GDPR_PACK])]
+        self.registered = set()
+        self.timings = []
+        self.progress_id = 0
+        self.run_count = 0
+
+        args = [self.codeql, "execute", "query-server2", "--threads=%d" % threads,
+                "--logdir=" + self.logdir]
+        args += list(ram_args or [])
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+        threading.Thread(target=self._drain_stderr, daemon=True).start()
+        self.rpc = JsonRpcConnection(self.process.stdout, self.process.stdin)
+        self.cli = CliServer(self.codeql, logdir=self.logdir)
+
+    def _drain_stderr(self):
+        for line in self.process.stderr:
+            if self.verbose:
+                sys.stderr.write(line.decode("utf-8", errors="replace"))
+
+    def _progress(self, method, params):
+        if self.verbose and method == "ql/progressUpdated" and params:
+            print(f"  [{params.get('step')}/{params.get('maxStep')}] {params.get('message')}")
+
+    def _request(self, method, body):
+        self.progress_id += 1
+        params = {"body": body, "progressId": self.progress_id}
+        return self.rpc.request(method, params, self._progress)
+
+    def register_databases(self, databases):
+        new = [os.path.abspath(db) for db in databases if os.path.abspath(db) not in self.registered]
+        if new:
+            self._request("evaluation/registerDatabases", {"databases": new})
+            self.registered.update(new)
+
+    def evaluate(self, query, database):
+        # Evaluate one query and return the path of its BQRS result file
+        query = os.path.abspath(query)
+        database = os.path.abspath(database)
+        self.register_databases([database])
+        self.run_count += 1
+        output = os.path.join(self.workdir, "results-%d.bqrs" % self.run_count)
+        start = time.perf_counter()
+        result = self._request("evaluation/runQuery", {
+            "db": database,
+            "queryPath": query,
+            "outputPath": output,
+            "additionalPacks": self.additional_packs,
+            "externalInputs": {},
+            "singletonExternalInputs": {},
+            "target": {"query": {}},
+        })
+        elapsed = time.perf_counter() - start
+        result_type = QUERY_RESULT_TYPES.get(result.get("resultType"), str(result.get("resultType")))
+        if result_type != "SUCCESS":
+            raise QueryServerError(f"{os.path.basename(query)} on {database}: {result_type} "
+                                   f"{result.get('message') or ''}".rstrip())
+        self.timings.append((query, database, elapsed))
+        if self.verbose:
+            print(f"Evaluated {os.path.basename(query)} on {database} in {elapsed:.2f}s")
+        return output
+
+    def decode(self, bqrs):
+        # Decode all result sets of a BQRS file through the cli-server
+        return self.cli.run_json(["bqrs", "decode", "--entities=url,string", bqrs])
+
+    def run_queries(self, queries=None, databases=("python-db",)):
+        # Returns {(query, database): {result set name: [row, ...]}}
+        queries = queries or GDPR_QUERIES
+        self.register_databases(databases)
+        results = {}
+        for database in databases:
+            for query in queries:
+                decoded = self.decode(self.evaluate(query, database))
+                results[(query, database)] = {name: result_set.get("tuples", [])
+                                              for name, result_set in decoded.items()}
+        return results
+
+    def close(self):
+        self.cli.close()
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def format_row(row):
+    # Entity columns are decoded as {"label": ..., "url": ...}
+    return [value.get("label", value) if isinstance(value, dict) else value for value in row]
+
+
+if __name__ == "__main__":
+    databases = sys.argv[1:] or ["python-db"]
+    resources = tune(databases, len(GDPR_QUERIES))
+    with QueryServer(threads=resources.threads, ram_args=resources.ram_args(), verbose=True) as server:
+        for (query, database), result_sets in server.run_queries(databases=databases).items():
+            for row in result_sets.get("#select", []):
+                print(f"  {database}: {format_row(row)[-1]}")
@@ -0,0 +1,151 @@
+import glob
+import os
+import sys
+
+from CodeQLCli import GDPR_QUERIES
+from CodeQLDatabaseCache import dir_size
+
+# Sizing heuristics, in MB. Evaluation memory grows with the extracted code and the
+# string pool; every query adds its own compiled plan and intermediate relations.
+BASE_RAM = 1024
+RAM_PER_KLOC = 8
+RAM_PER_POOL_MB = 4
+RAM_PER_QUERY = 128
+RAM_PER_THREAD = 256
+MIN_RAM = 1024
+MIN_HEAP = 512
+# Part of the host memory left to the OS, the extractor and other jobs on the runner
+HOST_RESERVE = 0.2
+# Below this size extra evaluator threads have nothing to work on
+SMALL_DATABASE_LOC = 10000
+
+
+class ResourceConfig:
+
+    def __init__(self, threads, ram_mb, heap_mb, off_heap_mb):
+        self.threads = threads
+        self.ram_mb = ram_mb
+        self.heap_mb = heap_mb
+        self.off_heap_mb = off_heap_mb
+
+    def ram_args(self):
+        # The JVM arguments `codeql resolve ram` would produce, for plumbing commands
+        # such as `execute query-server2`
+        return ["-J-Xmx%dM" % self.heap_mb, "--off-heap-ram=%d" % self.off_heap_mb]
+
+    def cli_args(self):
+        # For `query run`, `database analyze` and `database create`
+        return ["--threads=%d" % self.threads, "--ram=%d" % self.ram_mb]
+
+    def __str__(self):
+        return (f"--threads={self.threads} --ram={self.ram_mb} "
+                f"(heap {self.heap_mb} MB, off-heap {self.off_heap_mb} MB)")
+
+
+def baseline_loc(database):
+    try:
+        with open(os.path.join(database, "codeql-database.yml"), "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("baselineLinesOfCode:"):
+                    return int(line.split(":", 1)[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def string_pool_mb(database):
+    pools = glob.glob(os.path.join(database, "db-*", "default", "pools"))
+    return sum(dir_size(p) for p in pools) / (1024 * 1024)
+
+
+def cgroup_limit(paths):
+    for path in paths:
+        try:
+            with open(path, "r") as f:
+                value = f.read().split()
+        except OSError:
+            continue
+        if value and value[0] != "max":
+            return value
+    return None
+
+
+def available_memory_mb():
+    available = None
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) // 1024
+                    break
+    except OSError:
+        pass
+    if available is None and hasattr(os, "sysconf"):
+        try:
+            available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+        except (ValueError, OSError):
+            pass
+    if available is None and sys.platform == "win32":
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [("length", ctypes.c_ulong), ("load", ctypes.c_ulong),
+                        ("total_phys", ctypes.c_ulonglong), ("avail_phys", ctypes.c_ulonglong),
+                        ("total_page", ctypes.c_ulonglong), ("avail_page", ctypes.c_ulonglong),
+                        ("total_virtual", ctypes.c_ulonglong), ("avail_virtual", ctypes.c_ulonglong),
+                        ("avail_extended", ctypes.c_ulonglong)]
+        status = MemoryStatus()
+        status.length = ctypes.sizeof(MemoryStatus)
+        ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+        available = status.avail_phys // (1024 * 1024)
+    # CI runners are often containers with a tighter cgroup limit than the host
+    limit = cgroup_limit(["/sys/fs/cgroup/memory.max",
+                          "/sys/fs/cgroup/memory/memory.limit_in_bytes"])
+    if limit is not None:
+        limit_mb = int(limit[0]) // (1024 * 1024)
+        available = limit_mb if available is None else min(available, limit_mb)
+    return available if available is not None else 4096
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+    quota = cgroup_limit(["/sys/fs/cgroup/cpu.max"])
+    if quota is not None and len(quota) == 2:
+        cores = min(cores, max(1, int(quota[0]) // int(quota[1])))
+    return cores
+
+
+def tune(databases, query_count=len(GDPR_QUERIES), memory_mb=None, cores=None):
+    memory_mb = available_memory_mb() if memory_mb is None else memory_mb
+    cores = available_cores() if cores is None else cores
+    loc = sum(baseline_loc(db) for db in databases)
+    pool_mb = sum(string_pool_mb(db) for db in databases)
+
+    needed = int(BASE_RAM + RAM_PER_KLOC * loc / 1000 + RAM_PER_POOL_MB * pool_mb
+                 + RAM_PER_QUERY * query_count)
+    budget = int(memory_mb * (1 - HOST_RESERVE))
+    threads = cores if loc >= SMALL_DATABASE_LOC else min(cores, 2)
+    # Each extra thread keeps its own intermediate relations in memory
+    needed += RAM_PER_THREAD * (threads - 1)
+    ram = max(MIN_RAM, min(needed, budget))
+    while threads > 1 and needed > ram:
+        threads -= 1
+        needed -= RAM_PER_THREAD
+
+    # Leave some room for JVM overhead and split the rest between heap and relation cache
+    overhead = max(128, ram // 20)
+    heap = max(MIN_HEAP, (ram - overhead) // 2)
+    config = ResourceConfig(threads, ram, heap, ram - overhead - heap)
+
+    print(f"CodeQL resources: {loc} LOC, {pool_mb:.1f} MB string pool, {query_count} queries, "
+          f"{memory_mb} MB available, {cores} cores -> {config}")
+    if needed > ram:
+        print(f"[!] Estimated {needed} MB needed but only {ram} MB available")
+    return config
+
+
+if __name__ == "__main__":
+    tune(sys.argv[1:] or ["python-db"])
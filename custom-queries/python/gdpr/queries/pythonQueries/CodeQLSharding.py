@@ -0,0 +1,185 @@
+import argparse
+import heapq
+import json
+import os
+import pathlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+from CodeQLCli import GDPR_QUERIES, find_codeql, run_codeql
+from CodeQLDatabaseCache import DEFAULT_EXCLUDES, DatabaseCache, iter_source_files
+from CodeQLResources import available_cores, available_memory_mb, tune
+
+SOURCE_EXTENSIONS = (".py",)
+
+
+def split_units(rel_dir, target, dir_sizes, subdirs, direct_files):
+    # Returns [(size, pattern)] covering rel_dir, each unit at most `target` bytes where possible
+    if dir_sizes.get(rel_dir, 0) <= target and rel_dir:
+        return [(dir_sizes[rel_dir], rel_dir)]
+    units = []
+    for child in sorted(subdirs.get(rel_dir, ())):
+        units += split_units(child, target, dir_sizes, subdirs, direct_files)
+    files = direct_files.get(rel_dir, [])
+    files_size = sum(size for size, _ in files)
+    if files_size <= target:
+        if files:
+            pattern = rel_dir + "/*" if rel_dir else "*"
+            units += [(files_size, pattern + ext) for ext in SOURCE_EXTENSIONS]
+    else:
+        units += files
+    return units
+
+
+def partition(source_root, shard_count, excludes=DEFAULT_EXCLUDES):
+    # Returns a list of shards, each a list of `paths` patterns relative to source_root
+    dir_sizes = {}
+    subdirs = {}
+    direct_files = {}
+    total = 0
+    for rel_path, full_path in iter_source_files(source_root, excludes):
+        if not rel_path.endswith(SOURCE_EXTENSIONS):
+            continue
+        size = os.path.getsize(full_path)
+        total += size
+        parent = os.path.dirname(rel_path).replace(os.sep, "/")
+        direct_files.setdefault(parent, []).append((size, rel_path))
+        while True:
+            dir_sizes[parent] = dir_sizes.get(parent, 0) + size
+            if not parent:
+                break
+            grandparent = os.path.dirname(parent)
+            subdirs.setdefault(grandparent, set()).add(parent)
+            parent = grandparent
+
+    target = max(1, total // max(1, shard_count))
+    units = split_units("", target, dir_sizes, subdirs, direct_files)
+
+    # Largest units first, each into the currently smallest shard
+    shards = [(0, i, []) for i in range(shard_count)]
+    for size, pattern in sorted(units, reverse=True):
+        load, i, patterns = heapq.heappop(shards)
+        patterns.append(pattern)
+        heapq.heappush(shards, (load + size, i, patterns))
+    return [patterns for _, _, patterns in sorted(shards, key=lambda s: s[1]) if patterns]
+
+
+def analyze_shard(cache, source_root, index, paths, queries, workdir, memory_mb, cores):
+    database = cache.get_database(source_root, threads=cores, paths=paths, ram=memory_mb)
+    try:
+        resources = tune([database], len(queries), memory_mb, cores)
+        sarif = os.path.join(workdir, "shard-%03d.sarif" % index)
+        run_codeql(["database", "analyze", database] + list(queries)
+                   + ["--format=sarif-latest", "--output=" + sarif] + resources.cli_args(),
+                   cache.codeql)
+    finally:
+        cache.release(database)
+    print(f"Shard {index}: {len(paths)} path patterns analyzed")
+    return sarif
+
+
+def relative_uri(artifact_location, root):
+    uri = artifact_location.get("uri", "")
+    if uri.startswith("file:"):
+        path = unquote(urlparse(uri).path)
+        if os.name == "nt" and path.startswith("/"):
+            path = path[1:]
+        try:
+            uri = pathlib.Path(os.path.relpath(path, root)).as_posix()
+        except ValueError:
+            return artifact_location
+    return {"uri": uri, "uriBaseId": "%SRCROOT%"}
+
+
+def normalize_locations(locations, root):
+    for location in locations or []:
+        physical = location.get("physicalLocation")
+        if physical and "artifactLocation" in physical:
+            physical["artifactLocation"] = relative_uri(physical["artifactLocation"], root)
+
+
+def result_key(result):
+    location = (result.get("locations") or [{}])[0].get("physicalLocation", {})
+    region = location.get("region", {})
+    return (result.get("ruleId"), location.get("artifactLocation", {}).get("uri"),
+            region.get("startLine"), region.get("startColumn"),
+            region.get("endLine"), region.get("endColumn"),
+            result.get("message", {}).get("text"))
+
+
+def merge_sarif(sarif_files, source_root, output):
+    # Merge the runs of all shards into one run with deduplicated results and rules
+    root = os.path.abspath(source_root)
+    tool = None
+    rules = {}
+    seen = set()
+    results = []
+    for sarif_file in sarif_files:
+        with open(sarif_file, "r", encoding="utf-8") as f:
+            sarif = json.load(f)
+        for run in sarif.get("runs", []):
+            driver = run["tool"]["driver"]
+            if tool is None:
+                tool = run["tool"]
+            for rule in driver.get("rules", []):
+                rules.setdefault(rule["id"], rule)
+            for result in run.get("results", []):
+                normalize_locations(result.get("locations"), root)
+                normalize_locations(result.get("relatedLocations"), root)
+                key = result_key(result)
+                if key in seen:
+                    continue
+                seen.add(key)
+                results.append(result)
+
+    rule_indexes = {rule_id: i for i, rule_id in enumerate(rules)}
+    for result in results:
+        # Rule indexes refer to the merged rule list
+        if result.get("ruleId") in rule_indexes:
+            result["ruleIndex"] = rule_indexes[result["ruleId"]]
+            if "rule" in result:
+                result["rule"]["index"] = result["ruleIndex"]
+    if tool is not None:
+        tool["driver"]["rules"] = list(rules.values())
+    merged = {
+        "$schema": "https://json.schemastore.org/sarif-2.1.0.json",
+        "version": "2.1.0",
+        "runs": [{
+            "tool": tool or {"driver": {"name": "CodeQL", "rules": []}},
+            "originalUriBaseIds": {"%SRCROOT%": {"uri": pathlib.Path(root).as_uri() + "/"}},
+            "results": results,
+        }],
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(merged, f)
+    print(f"Written {output} with {len(results)} results from {len(sarif_files)} shards")
+
+
+def run_sharded(source_root, output, shard_count, parallel, queries=None, workdir=None):
+    queries = [os.path.abspath(q) for q in (queries or GDPR_QUERIES)]
+    cache = DatabaseCache(codeql=find_codeql())
+    workdir = workdir or tempfile.mkdtemp(prefix="gdpr-shards-")
+    shards = partition(source_root, shard_count)
+    print(f"Partitioned {source_root} into {len(shards)} shards, {parallel} at a time")
+    # Every concurrent shard gets an equal share of the machine
+    memory_mb = max(1024, available_memory_mb() // parallel)
+    cores = max(1, available_cores() // parallel)
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        futures = [executor.submit(analyze_shard, cache, source_root, i, paths, queries, workdir,
+                                   memory_mb, cores)
+                   for i, paths in enumerate(shards)]
+        sarif_files = [future.result() for future in futures]
+    merge_sarif(sarif_files, source_root, output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and analyze a source tree in shards.")
+    parser.add_argument("source_root", nargs="?", default="test-code")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--parallel", type=int, default=2, help="Shards processed at once")
+    parser.add_argument("--query", action="append", help="Defaults to SensitiveData.ql")
+    parser.add_argument("--output", default="gdpr-results.sarif")
+    parser.add_argument("--workdir", default=None)
+    args = parser.parse_args()
+    run_sharded(args.source_root, args.output, args.shards, args.parallel, args.query, args.workdir)
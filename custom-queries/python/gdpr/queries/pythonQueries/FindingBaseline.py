@@ -0,0 +1,134 @@
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+
+from FindingFusion import RULE_IDS, fuse, normalize_snippet, read_bqrs, read_sarif
+from PythonQueryGeneral import read_snippets
+
+BASELINE_HEADER = "# gdpr-analyzer baseline v1"
+DEFAULT_BASELINE = ".gdpr-baseline"
+
+# A line ending in `# gdpr: ignore` suppresses every finding on it, one ending in
+# `# gdpr: ignore[rule, ...]` only those rules. The marker in a string literal does not count.
+SUPPRESSION_PATTERN = re.compile(r"#\s*gdpr:\s*ignore(?:\[([\w\s,-]*)\])?\s*$")
+
+
+def baseline_fingerprint(rule, path, snippet, occurrence):
+    # Unlike Finding.fingerprint this leaves out the line number, so findings keep their
+    # fingerprint when code above them moves. `occurrence` tells identical lines apart.
+    key = "\0".join((rule, path, normalize_snippet(snippet), str(occurrence)))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def is_suppressed(rule, snippet):
+    m = SUPPRESSION_PATTERN.search(snippet)
+    if m is None:
+        return False
+    rules = m.group(1)
+    return rules is None or rule in (r.strip() for r in rules.split(","))
+
+
+def finding_key(finding):
+    return finding.rule, finding.path, finding.snippet
+
+
+def with_fingerprints(findings, key=finding_key):
+    # Yields (finding, baseline fingerprint) for a stream of findings that arrives file by file
+    # in line order. `key` gives the (rule, path, snippet) of a finding.
+    occurrences = {}
+    path = None
+    for finding in findings:
+        rule, finding_path, snippet = key(finding)
+        if finding_path != path:
+            occurrences = {}
+            path = finding_path
+        counted = (rule, normalize_snippet(snippet))
+        occurrence = occurrences.get(counted, 0)
+        occurrences[counted] = occurrence + 1
+        yield finding, baseline_fingerprint(rule, finding_path, snippet, occurrence)
+
+
+class Baseline:
+
+    def __init__(self, fingerprints=(), root="."):
+        self.fingerprints = set(fingerprints)
+        self.root = root
+
+    @classmethod
+    def load(cls, path, root="."):
+        if not os.path.exists(path):
+            return cls(root=root)
+        with open(path, "r", encoding="ascii") as f:
+            data = f.read()
+        if data.startswith("#"):
+            data = data[data.find("\n") + 1:]
+        return cls(data.split(), root)
+
+    def save(self, path):
+        with open(path, "w", encoding="ascii") as f:
+            f.write(BASELINE_HEADER + "\n")
+            for fingerprint in sorted(self.fingerprints):
+                f.write(fingerprint + "\n")
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self.fingerprints
+
+    def fingerprint_file(self, rule_path_snippets):
+        # Yields the baseline fingerprint of each (rule, path, snippet) of one file, in line order
+        for _, fingerprint in with_fingerprints(rule_path_snippets, key=tuple):
+            yield fingerprint
+
+    def filter_results(self, filepath, results):
+        # Filters the FlaggedLines of PythonQueryGeneral.analyze_file
+        path = os.path.relpath(filepath, self.root).replace(os.sep, "/")
+        keys = [(RULE_IDS.get(r.rule, r.rule), path, snippet)
+                for r, snippet in zip(results, read_snippets(results))]
+        # Occurrences only count within one rule, whose results are already in line order
+        return [result for result, (rule, _, snippet), fingerprint
+                in zip(results, keys, self.fingerprint_file(keys))
+                if fingerprint not in self.fingerprints and not is_suppressed(rule, snippet)]
+
+    def filter_findings(self, findings):
+        # Filters a stream of fused findings that arrives file by file in line order
+        for finding, fingerprint in with_fingerprints(findings):
+            if fingerprint not in self.fingerprints and not is_suppressed(finding.rule,
+                                                                         finding.snippet):
+                yield finding
+
+    def add_findings(self, findings):
+        self.fingerprints.update(fingerprint for _, fingerprint in with_fingerprints(findings))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record accepted findings or report new ones.")
+    parser.add_argument("command", choices=["check", "update"])
+    parser.add_argument("source_root", nargs="?", default="test-code")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--sarif", action="append", default=[], help="CodeQL SARIF results")
+    parser.add_argument("--bqrs", action="append", default=[], help="CodeQL BQRS results")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    baseline = Baseline.load(args.baseline, args.source_root)
+    print(f"Loaded {len(baseline)} baseline entries in {time.perf_counter() - start:.3f}s",
+          file=sys.stderr)
+    streams = [read_sarif(s, args.source_root) for s in args.sarif]
+    streams += [read_bqrs(b) for b in args.bqrs]
+    findings = fuse(args.source_root, streams)
+    if args.command == "update":
+        baseline.add_findings(findings)
+        baseline.save(args.baseline)
+        print(f"Written {len(baseline)} entries to {args.baseline}")
+    else:
+        new = 0
+        for finding in baseline.filter_findings(findings):
+            new += 1
+            print(f"{finding.path}:{finding.line}: [{finding.rule}] {finding.snippet}")
+        print(f"{new} new findings", file=sys.stderr)
+        sys.exit(1 if new else 0)
@@ -0,0 +1,327 @@
+import argparse
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+
+from CodeQLCli import find_codeql
+from CodeQLDatabaseCache import iter_source_files
+from CodeQLSharding import relative_uri
+from PythonQueryGeneral import LINE_BREAK, analyze_file, read_snippets
+
+# CodeQL tags and Python scanner labels for the same kind of leak share one rule id
+RULE_IDS = {
+    # SensitiveData.ql
+    "printed": "printed",
+    "written": "sensitive-write",
+    "inserted": "db-insert",
+    "cookie-responded": "cookie",
+    "logged": "logged",
+    "sent-http": "sent-http",
+    "returned-http": "returned-http",
+    "json-returned": "json-returned",
+    "no-consent": "consent-revoked",
+    "url-assigned": "url-embedding",
+    "in-sql": "sql-injection",
+    "in-exception": "exception-message",
+    "stored-locally": "local-storage",
+    "redirect-returned": "redirect",
+    # PythonQueryGeneral.py
+    "Consent Revoked": "consent-revoked",
+    "Card Pattern": "card-number",
+    "SSN Pattern": "ssn-number",
+    "Sensitive Write": "sensitive-write",
+    "Sensitive URL Embedding": "url-embedding",
+    "SQL Injection Risk": "sql-injection",
+    "Sensitive in Exception": "exception-message",
+    "Local Storage Usage": "local-storage",
+}
+
+# Characters read at a time from a SARIF file
+READ_CHUNK_CHARS = 1 << 20
+# CodeQL findings spilled per executemany call
+SPILL_BATCH_SIZE = 10000
+
+CODEQL_MESSAGE_PATTERN = re.compile(
+    r"Sensitive variable '(\w+)' ([\w-]+) in file: (.*) on line (\d+)$")
+
+
+def normalize_snippet(snippet):
+    return " ".join(snippet.split())
+
+
+class Finding:
+    __slots__ = ("rule", "path", "line", "snippet", "sources", "messages")
+
+    def __init__(self, rule, path, line, snippet, source, message):
+        self.rule = rule
+        self.path = path
+        self.line = line
+        self.snippet = snippet
+        self.sources = [source]
+        self.messages = [message]
+
+    @property
+    def fingerprint(self):
+        key = "\0".join((self.rule, self.path, str(self.line), normalize_snippet(self.snippet)))
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+    def merge(self, other):
+        for source, message in zip(other.sources, other.messages):
+            if source not in self.sources:
+                self.sources.append(source)
+            if message not in self.messages:
+                self.messages.append(message)
+
+    def to_json(self):
+        return json.dumps({"fingerprint": self.fingerprint, "rule": self.rule, "path": self.path,
+                           "line": self.line, "snippet": self.snippet, "sources": self.sources,
+                           "messages": self.messages})
+
+
+def codeql_finding(message, path=None, line=None):
+    m = CODEQL_MESSAGE_PATTERN.search(message)
+    if m:
+        rule = RULE_IDS.get(m.group(2), m.group(2))
+        path = path or m.group(3).replace("\\", "/")
+        line = line or int(m.group(4))
+    else:
+        rule = "codeql"
+    return Finding(rule, path, line, "", "codeql", message)
+
+
+class JsonStream:
+    # Incremental reader of one JSON document: objects and arrays are walked member by member
+    # and only the values asked for are decoded, so a document never has to fit in memory.
+
+    def __init__(self, f):
+        self.f = f
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+
+    def read_more(self):
+        more = self.f.read(READ_CHUNK_CHARS)
+        if more:
+            self.buffer = self.buffer[self.pos:] + more
+            self.pos = 0
+        return bool(more)
+
+    def peek(self):
+        # The next non-whitespace character, or "" at the end of the file
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read_more():
+                return ""
+
+    def expect(self, chars):
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError(f"Expected one of {chars!r} but found {c!r} in {self.f.name}")
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.read_more():
+                    raise
+                continue
+            # A number may continue in the next chunk
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                rest = end
+                while rest < len(self.buffer) and self.buffer[rest] in "0123456789+-.eE":
+                    rest += 1
+                if rest == len(self.buffer) and self.read_more():
+                    continue
+            self.pos = end
+            return value
+
+    def members(self):
+        # Yields the keys of an object; the caller reads or skips each value before the next
+        if self.peek() != "{":
+            self.value()
+            return
+        self.pos += 1
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.expect(",}") == "}":
+                return
+
+    def elements(self):
+        # Yields once per array element; the caller reads or skips each element
+        if self.peek() != "[":
+            self.value()
+            return
+        self.pos += 1
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.expect(",]") == "]":
+                return
+
+
+def iter_sarif_results(sarif_file):
+    # Yields the results of all runs, decoding one result at a time
+    with open(sarif_file, "r", encoding="utf-8") as f:
+        stream = JsonStream(f)
+        for key in stream.members():
+            if key != "runs":
+                stream.value()
+                continue
+            for _ in stream.elements():
+                for run_key in stream.members():
+                    if run_key != "results":
+                        stream.value()
+                        continue
+                    for _ in stream.elements():
+                        yield stream.value()
+
+
+def read_sarif(sarif_file, source_root):
+    root = os.path.abspath(source_root)
+    for result in iter_sarif_results(sarif_file):
+        location = (result.get("locations") or [{}])[0].get("physicalLocation", {})
+        path = relative_uri(location.get("artifactLocation", {}), root).get("uri")
+        line = location.get("region", {}).get("startLine")
+        finding = codeql_finding(result.get("message", {}).get("text", ""), path, line)
+        if finding.rule == "codeql":
+            finding.rule = result.get("ruleId", "codeql")
+        yield finding
+
+
+def read_bqrs(bqrs_file, codeql=None):
+    # Streams rows of `codeql bqrs decode --format=csv`; the message carries path and line
+    cmd = [codeql or find_codeql(), "bqrs", "decode", "--format=csv", "--no-titles",
+           "--result-set=#select", bqrs_file]
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE) as process:
+        for row in csv.reader(io.TextIOWrapper(process.stdout, encoding="utf-8")):
+            if row:
+                yield codeql_finding(row[-1])
+    if process.returncode != 0:
+        # Otherwise a failed decode would look like a result set without findings
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+
+
+def scan_findings(rel_path, full_path):
+    flagged_lines = analyze_file(full_path)
+    findings = []
+    for flagged, snippet in zip(flagged_lines, read_snippets(flagged_lines)):
+        findings.append(Finding(RULE_IDS.get(flagged.rule, flagged.rule), rel_path, flagged.line,
+                                snippet, "python", "[" + flagged.rule + "] " + snippet))
+    return findings
+
+
+def read_lines(full_path):
+    # The lines as CodeQL and the scanners number them: only \r\n, \r and \n end a line,
+    # not the form feeds and other separators str.splitlines also breaks at
+    with open(full_path, "rb") as f:
+        return [line.decode("utf-8", errors="replace") for line in LINE_BREAK.split(f.read())]
+
+
+def fuse_file(rel_path, full_path, scanner_findings, codeql_findings):
+    # Hash join of one file's findings on their fingerprints
+    if codeql_findings:
+        lines = read_lines(full_path) if os.path.isfile(full_path) else []
+        for finding in codeql_findings:
+            if finding.line and finding.line <= len(lines):
+                finding.snippet = lines[finding.line - 1].strip()
+    fused = {}
+    for finding in codeql_findings + scanner_findings:
+        fingerprint = finding.fingerprint
+        if fingerprint in fused:
+            fused[fingerprint].merge(finding)
+        else:
+            fused[fingerprint] = finding
+    return sorted(fused.values(), key=lambda f: (f.line or 0, f.rule))
+
+
+def spill_codeql(codeql_streams):
+    # CodeQL results come in no particular path order, so they are spilled into a temporary
+    # SQLite database, which SQLite keeps on disk once it outgrows its page cache, and read
+    # back one file at a time
+    connection = sqlite3.connect("")
+    connection.execute("CREATE TABLE codeql (path TEXT, rule TEXT, line INTEGER, message TEXT)")
+    rows = ((f.path, f.rule, f.line, f.messages[0])
+            for stream in codeql_streams for f in stream)
+    while True:
+        batch = list(itertools.islice(rows, SPILL_BATCH_SIZE))
+        if not batch:
+            break
+        connection.executemany("INSERT INTO codeql VALUES (?, ?, ?, ?)", batch)
+    connection.execute("CREATE INDEX codeql_path ON codeql(path)")
+    return connection
+
+
+def take_codeql(connection, rel_path):
+    # Removes and returns the spilled CodeQL findings of one file, in the order they were read
+    rows = connection.execute(
+        "SELECT rule, line, message FROM codeql WHERE path IS ? ORDER BY rowid",
+        (rel_path,)).fetchall()
+    if rows:
+        connection.execute("DELETE FROM codeql WHERE path IS ?", (rel_path,))
+    return [Finding(rule, rel_path, line, "", "codeql", message) for rule, line, message in rows]
+
+
+def fuse(source_root, codeql_streams):
+    # Yields fused findings file by file, holding only one file's findings in memory: the
+    # CodeQL findings are spilled to disk first and joined with the scanner findings per file
+    connection = spill_codeql(codeql_streams)
+    try:
+        for rel_path, full_path in iter_source_files(source_root):
+            if not rel_path.endswith(".py"):
+                continue
+            try:
+                scanner_findings = scan_findings(rel_path, full_path)
+            except UnicodeDecodeError:
+                scanner_findings = []
+            yield from fuse_file(rel_path, full_path, scanner_findings,
+                                 take_codeql(connection, rel_path))
+
+        # CodeQL results for files the scanners did not visit
+        remaining = connection.execute(
+            "SELECT DISTINCT path FROM codeql ORDER BY path").fetchall()
+        for (rel_path,) in remaining:
+            yield from fuse_file(rel_path, os.path.join(source_root, rel_path or ""), [],
+                                 take_codeql(connection, rel_path))
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Combine CodeQL and Python scanner findings into one deduplicated report.")
+    parser.add_argument("source_root", nargs="?", default="test-code")
+    parser.add_argument("--sarif", action="append", default=[], help="CodeQL SARIF results")
+    parser.add_argument("--bqrs", action="append", default=[], help="CodeQL BQRS results")
+    parser.add_argument("--output", help="JSON lines report (default: stdout)")
+    args = parser.parse_args()
+
+    streams = [read_sarif(s, args.source_root) for s in args.sarif]
+    streams += [read_bqrs(b) for b in args.bqrs]
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    try:
+        for finding in fuse(args.source_root, streams):
+            out.write(finding.to_json() + "\n")
+    finally:
+        if args.output:
+            out.close()
@@ -0,0 +1,167 @@
+import argparse
+import itertools
+import sqlite3
+import sys
+import time
+
+from CodeQLCli import git_commit
+from FindingBaseline import with_fingerprints
+from FindingFusion import fuse, read_bqrs, read_sarif
+
+DEFAULT_STORE = "gdpr-findings.db"
+# Rows per executemany call; bounds memory when a run is streamed in
+BATCH_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    source_root TEXT NOT NULL,
+    git_commit TEXT,
+    findings INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS findings (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    fingerprint TEXT NOT NULL,
+    rule TEXT NOT NULL,
+    path TEXT,
+    line INTEGER,
+    snippet TEXT,
+    sources TEXT,
+    first_run INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS findings_rule ON findings(run_id, rule);
+CREATE INDEX IF NOT EXISTS findings_path ON findings(run_id, path);
+CREATE INDEX IF NOT EXISTS findings_first_run ON findings(run_id, first_run);
+CREATE INDEX IF NOT EXISTS findings_fingerprint ON findings(fingerprint, run_id);
+-- The run in which each fingerprint was first recorded
+CREATE TABLE IF NOT EXISTS fingerprints (
+    fingerprint TEXT PRIMARY KEY,
+    first_run INTEGER NOT NULL
+) WITHOUT ROWID;
+-- Per-run counts, filled when a run is recorded so the summaries never scan its findings
+CREATE TABLE IF NOT EXISTS rule_counts (run_id INTEGER NOT NULL, rule TEXT NOT NULL, n INTEGER);
+CREATE TABLE IF NOT EXISTS path_counts (run_id INTEGER NOT NULL, path TEXT, n INTEGER);
+CREATE INDEX IF NOT EXISTS rule_counts_run ON rule_counts(run_id, n DESC, rule);
+CREATE INDEX IF NOT EXISTS path_counts_run ON path_counts(run_id, n DESC, path);
+"""
+
+
+class FindingStore:
+
+    def __init__(self, path=DEFAULT_STORE):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record_run(self, source_root, findings, commit=None):
+        # Writes a whole run in one transaction and returns its id. `findings` is a stream of
+        # fused findings in the order FindingFusion.fuse yields them.
+        rows = ((fingerprint, f.rule, f.path, f.line, f.snippet, ",".join(f.sources))
+                for f, fingerprint in with_fingerprints(findings))
+        with self.connection:
+            run_id = self.connection.execute(
+                "INSERT INTO runs (started, source_root, git_commit) VALUES (?, ?, ?)",
+                (time.time(), source_root, commit)).lastrowid
+            self.connection.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS staging (fingerprint TEXT, rule TEXT, path TEXT,"
+                " line INTEGER, snippet TEXT, sources TEXT)")
+            self.connection.execute("DELETE FROM staging")
+            count = 0
+            while True:
+                batch = list(itertools.islice(rows, BATCH_SIZE))
+                if not batch:
+                    break
+                self.connection.executemany("INSERT INTO staging VALUES (?, ?, ?, ?, ?, ?)", batch)
+                count += len(batch)
+            self.connection.execute(
+                "INSERT OR IGNORE INTO fingerprints SELECT fingerprint, ? FROM staging", (run_id,))
+            self.connection.execute(
+                "INSERT INTO findings SELECT ?, s.fingerprint, rule, path, line, snippet, sources,"
+                " f.first_run FROM staging s JOIN fingerprints f ON f.fingerprint = s.fingerprint",
+                (run_id,))
+            self.connection.execute("DELETE FROM staging")
+            self.connection.execute("UPDATE runs SET findings = ? WHERE id = ?", (count, run_id))
+            self.connection.execute(
+                "INSERT INTO rule_counts SELECT run_id, rule, COUNT(*) FROM findings"
+                " WHERE run_id = ? GROUP BY rule", (run_id,))
+            self.connection.execute(
+                "INSERT INTO path_counts SELECT run_id, path, COUNT(*) FROM findings"
+                " WHERE run_id = ? GROUP BY path", (run_id,))
+        return run_id
+
+    def runs(self):
+        return self.connection.execute(
+            "SELECT id, started, source_root, git_commit, findings FROM runs"
+            " ORDER BY id").fetchall()
+
+    def latest_run(self):
+        row = self.connection.execute("SELECT MAX(id) FROM runs").fetchone()
+        return row[0]
+
+    def new_since(self, since_run, run_id=None):
+        # Findings of run_id (default: the latest run) that no run up to since_run had
+        run_id = run_id or self.latest_run()
+        return self.connection.execute(
+            "SELECT rule, path, line, snippet FROM findings WHERE run_id = ? AND first_run > ?"
+            " ORDER BY path, line", (run_id, since_run)).fetchall()
+
+    def top_files(self, run_id=None, limit=10):
+        run_id = run_id or self.latest_run()
+        return self.connection.execute(
+            "SELECT path, n FROM path_counts WHERE run_id = ?"
+            " ORDER BY n DESC, path LIMIT ?", (run_id, limit)).fetchall()
+
+    def rules_by_volume(self, run_id=None):
+        run_id = run_id or self.latest_run()
+        return self.connection.execute(
+            "SELECT rule, n FROM rule_counts WHERE run_id = ?"
+            " ORDER BY n DESC, rule", (run_id,)).fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the findings of every run in SQLite.")
+    parser.add_argument("command", choices=["record", "runs", "new-since", "top-files", "rules"])
+    parser.add_argument("source_root", nargs="?", default="test-code")
+    parser.add_argument("--store", default=DEFAULT_STORE)
+    parser.add_argument("--sarif", action="append", default=[], help="CodeQL SARIF results")
+    parser.add_argument("--bqrs", action="append", default=[], help="CodeQL BQRS results")
+    parser.add_argument("--run", type=int, help="Run to query (default: the latest)")
+    parser.add_argument("--since", type=int, help="Earlier run for new-since")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    with FindingStore(args.store) as store:
+        start = time.perf_counter()
+        if args.command == "record":
+            streams = [read_sarif(s, args.source_root) for s in args.sarif]
+            streams += [read_bqrs(b) for b in args.bqrs]
+            run_id = store.record_run(args.source_root, fuse(args.source_root, streams),
+                                      git_commit())
+            print(f"Recorded run {run_id}")
+        elif args.command == "runs":
+            for run_id, started, source_root, commit, findings in store.runs():
+                print(f"{run_id}\t{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))}"
+                      f"\t{source_root}\t{commit or '-'}\t{findings} findings")
+        elif args.command == "new-since":
+            if args.since is None:
+                parser.error("new-since needs --since")
+            for rule, path, line, snippet in store.new_since(args.since, args.run):
+                print(f"{path}:{line}: [{rule}] {snippet}")
+        elif args.command == "top-files":
+            for path, count in store.top_files(args.run, args.top):
+                print(f"{count:8d}  {path}")
+        else:
+            for rule, count in store.rules_by_volume(args.run):
+                print(f"{count:8d}  {rule}")
+        print(f"({(time.perf_counter() - start) * 1000:.1f} ms)", file=sys.stderr)
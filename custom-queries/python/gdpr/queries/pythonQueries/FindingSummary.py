@@ -0,0 +1,117 @@
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+
+from CodeQLDatabaseCache import iter_source_files
+from PythonQueryGeneral import SENSITIVE_VARS, analyze_file, detect
+
+SENSITIVE_VAR_LIST = sorted(SENSITIVE_VARS)
+
+
+class Summary:
+    # Finding counts per rule, directory and sensitive identifier. Its size depends on the
+    # number of rules and directories, never on the number of findings.
+
+    def __init__(self):
+        self.files = 0
+        self.lines = 0
+        self.findings = 0
+        self.by_rule = Counter()
+        self.by_directory = Counter()
+        self.by_identifier = Counter()
+
+    def add_file(self, rel_path, full_path):
+        with open(full_path, "r", encoding="utf-8") as f:
+            text = f.read()
+        by_rule = self.by_rule
+        by_identifier = self.by_identifier
+        hits = 0
+
+        def emit(rule, i, start, line):
+            nonlocal hits
+            hits += 1
+            by_rule[rule] += 1
+            for var in SENSITIVE_VAR_LIST:
+                if var in line:
+                    by_identifier[var] += 1
+
+        detect(text, emit, numbered=False)
+        self.files += 1
+        self.lines += text.count("\n")
+        if hits:
+            self.findings += hits
+            self.by_directory[os.path.dirname(rel_path) or "."] += hits
+
+    def merge(self, other):
+        self.files += other.files
+        self.lines += other.lines
+        self.findings += other.findings
+        self.by_rule.update(other.by_rule)
+        self.by_directory.update(other.by_directory)
+        self.by_identifier.update(other.by_identifier)
+
+
+def python_files(source_root):
+    return ((rel, full) for rel, full in iter_source_files(source_root) if rel.endswith(".py"))
+
+
+def summarize(source_root):
+    summary = Summary()
+    for rel_path, full_path in python_files(source_root):
+        try:
+            summary.add_file(rel_path, full_path)
+        except UnicodeDecodeError:
+            pass
+    return summary
+
+
+def full_report(source_root, out):
+    # What scan_directory does for the same tree: build and write every finding
+    count = 0
+    for rel_path, full_path in python_files(source_root):
+        try:
+            results = analyze_file(full_path)
+        except UnicodeDecodeError:
+            continue
+        if results:
+            out.write(f"\n[!] Issues in {rel_path}:\n")
+            for file, line_num, message in results:
+                out.write(f"  Line {line_num}: {message}\n")
+            count += len(results)
+    return count
+
+
+def print_summary(summary, top):
+    print(f"{summary.findings} findings in {summary.files} files ({summary.lines} lines)")
+    for title, counter in (("Rule", summary.by_rule), ("Directory", summary.by_directory),
+                           ("Identifier", summary.by_identifier)):
+        print(f"\n{title:<40} {'Findings':>10}")
+        for key, count in counter.most_common(top):
+            print(f"{key:<40} {count:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Count Python scanner findings per rule, directory and sensitive identifier.")
+    parser.add_argument("source_root", nargs="?", default="test-code")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--compare", action="store_true",
+                        help="Also time full-report mode on the same tree")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    summary = summarize(args.source_root)
+    seconds = time.perf_counter() - start
+    print_summary(summary, args.top)
+    print(f"\nSummary mode: {seconds:.2f}s, {summary.lines / max(seconds, 1e-9):,.0f} lines/s",
+          file=sys.stderr)
+    if args.compare:
+        start = time.perf_counter()
+        with open(os.devnull, "w", encoding="utf-8") as devnull:
+            findings = full_report(args.source_root, devnull)
+        full_seconds = time.perf_counter() - start
+        print(f"Full report:  {full_seconds:.2f}s, "
+              f"{summary.lines / max(full_seconds, 1e-9):,.0f} lines/s, {findings} findings",
+              file=sys.stderr)
@@ -1,5 +1,7 @@
 import os
 import re
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
 
 # Regex patterns
 REVOCATION_PATTERN = re.compile(r"\bconsent\s*=\s*False\b")
@@ -20,95 +22,454 @@ LOCAL_STORAGE_PATTERN = re.compile(
 SENSITIVE_VARS = {"email", "ssn", "dob", "password"}
 
 
-def analyze_file(filepath):
-    with open(filepath, "r", encoding="utf-8") as f:
-        lines = f.readlines()
+# Labels of the detectors, in the order analyze_file reports them
+RULES = ("Consent Revoked", "Card Pattern", "SSN Pattern", "Sensitive Write",
+         "Sensitive URL Embedding", "SQL Injection Risk", "Sensitive in Exception",
+         "Local Storage Usage")
+RULE_INDEX = {rule: rule_id for rule_id, rule in enumerate(RULES)}
 
-    flagged_lines = []
-    revoked_line_nums = set()
-    inside_consent_block = False
-    indent_level = None
+
+def candidate_starts(pattern, text, folded, literals):
+    # Yields, in order, the start offsets of the lines pattern can match in. With literals,
+    # those are the lines containing one of them in `folded`, the lower-cased text; without,
+    # the lines where a search of the whole text lands.
+    if folded is None or not literals:
+        pos = 0
+        while True:
+            m = pattern.search(text, pos)
+            if m is None:
+                return
+            yield text.rfind("\n", 0, m.start()) + 1
+            pos = text.find("\n", m.start()) + 1 or len(text)
+    starts = set()
+    for literal in literals:
+        pos = folded.find(literal)
+        while pos != -1:
+            starts.add(text.rfind("\n", 0, pos) + 1)
+            pos = folded.find(literal, pos + 1)
+    yield from sorted(starts)
+
+
+def matching_lines(pattern, text, folded=None, literals=None, numbered=True):
+    # Yields (line index, line start, line, match) for every line in which pattern.search(line)
+    # matches,
+    # cutting out only candidate lines instead of searching every line. `literals` are
+    # lower-case strings one of which every match contains. A match of the whole text that
+    # runs into the next line is checked again against its own line; the patterns above never
+    # look past a line end, so no line with a match of its own is skipped. With numbered=False
+    # the line index is not counted and always None.
+    line_index = 0 if numbered else None
+    counted = 0
+    for start in candidate_starts(pattern, text, folded, literals):
+        end = text.find("\n", start) + 1 or len(text)
+        if numbered:
+            line_index += text.count("\n", counted, start)
+            counted = start
+        line = text[start:end]
+        m = pattern.search(line)
+        if m is not None:
+            yield line_index, start, line, m
+
+
+def split_lines(text):
+    # The lines readlines() returns for text read in text mode
+    lines = text.split("\n")
+    last = lines.pop()
+    lines = [line + "\n" for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+
+def fold(text):
+    # The lower-cased text the literals of matching_lines are looked up in. Case-insensitive
+    # patterns can match non-ASCII text that lower() does not map to a literal.
+    return text.lower() if text.isascii() else None
+
+
+def risky_uses(text, folded):
+    # {line index: line start} of the risky calls with sensitive data
+    return {i: start for i, start, line, _ in matching_lines(RISKY_USE_PATTERN, text, folded,
+                                                             ("send", "notify"))
+            if any(var in line for var in SENSITIVE_VARS)}
+
+
+def detect(text, emit, numbered=True):
+    # Runs every detector over the text of a file and calls emit(rule, line index, line start,
+    # line) per hit. With numbered=False only consent revocations carry a line index, the other
+    # rules None.
+    folded = fold(text)
+    detect_consent(text, emit, folded)
+    detect_line_rules(text, emit, folded, numbered)
+
+
+def detect_consent(text, emit, folded):
+    # Risky calls after a consent revocation, outside `if consent:` blocks
 
     # --- Consent Revocation Detection ---
-    for i, line in enumerate(lines):
-        if REVOCATION_PATTERN.search(line):
-            revoked_line_nums.add(i)
-
-    for i, line in enumerate(lines):
-        stripped = line.strip()
-
-        # Track consent block state by indentation
-        if CONSENT_BLOCK_PATTERN.match(line):
-            inside_consent_block = True
-            indent_level = len(line) - len(line.lstrip())
-            continue
-
-        # Exit consent block if indentation decreases
-        if inside_consent_block:
-            current_indent = len(line) - len(line.lstrip())
-            if current_indent <= indent_level and stripped != "":
-                inside_consent_block = False
+    first_revoked = next(matching_lines(REVOCATION_PATTERN, text, folded, ("consent",)), None)
+    risky_lines = risky_uses(text, folded)
+    if first_revoked is not None and risky_lines:
+        first_revoked = first_revoked[0]
+        inside_consent_block = False
+        indent_level = None
+        start = 0
+
+        for i, line in enumerate(split_lines(text)):
+            line_start = start
+            start += len(line)
+
+            # Track consent block state by indentation
+            if "consent" in line and CONSENT_BLOCK_PATTERN.match(line):
+                inside_consent_block = True
+                indent_level = len(line) - len(line.lstrip())
+                continue
+
+            # Exit consent block if indentation decreases
+            if inside_consent_block:
+                current_indent = len(line) - len(line.lstrip())
+                if current_indent <= indent_level and line.strip() != "":
+                    inside_consent_block = False
 
-        # Skip risky ops inside consent block
-        if inside_consent_block:
-            continue
+            # Skip risky ops inside consent block
+            if inside_consent_block:
+                continue
 
-        # Consent revoked? Flag risky usage
-        if any(revoked <= i for revoked in revoked_line_nums):
-            if RISKY_USE_PATTERN.search(line) and any(var in line for var in SENSITIVE_VARS):
-                flagged_lines.append((filepath, i + 1, "[Consent Revoked] " + stripped))
+            # Consent revoked? Flag risky usage
+            if i >= first_revoked and i in risky_lines:
+                emit("Consent Revoked", i, line_start, line)
+
+
+def detect_line_rules(text, emit, folded, numbered=True):
+    # The detectors that only look at the line they flag
 
     # --- Card Number Detection (skip if wrapped in hash or other function) ---
-    for i, line in enumerate(lines):
-        if CARD_PATTERN.search(line):
-            if not re.search(r'\w+\s*\(\s*"\d{4}-\d{4}-\d{4}-\d{4}"\s*\)', line):
-                flagged_lines.append((filepath, i + 1, "[Card Pattern] " + line.strip()))
+    for i, start, line, _ in matching_lines(CARD_PATTERN, text, numbered=numbered):
+        if not re.search(r'\w+\s*\(\s*"\d{4}-\d{4}-\d{4}-\d{4}"\s*\)', line):
+            emit("Card Pattern", i, start, line)
 
     # --- SSN Detection (skip if wrapped in hash or other function) ---
-    for i, line in enumerate(lines):
-        if SSN_PATTERN.search(line):
-            if not re.search(r'\w+\s*\(\s*"\d{3}-\d{2}-\d{4}"\s*\)', line):
-                flagged_lines.append((filepath, i + 1, "[SSN Pattern] " + line.strip()))
+    for i, start, line, _ in matching_lines(SSN_PATTERN, text, numbered=numbered):
+        if not re.search(r'\w+\s*\(\s*"\d{3}-\d{2}-\d{4}"\s*\)', line):
+            emit("SSN Pattern", i, start, line)
 
     # --- Sensitive Write Detection ---
-    for i, line in enumerate(lines):
-        if WRITE_PATTERN.search(line) and any(var in line for var in SENSITIVE_VARS):
-            flagged_lines.append((filepath, i + 1, "[Sensitive Write] " + line.strip()))
+    for i, start, line, _ in matching_lines(WRITE_PATTERN, text, folded, (".write",), numbered):
+        if any(var in line for var in SENSITIVE_VARS):
+            emit("Sensitive Write", i, start, line)
 
     # --- Sensitive Data Embedded in URL Detection (not hashed) ---
-    for i, line in enumerate(lines):
-        match = URL_PATTERN.search(line)
-        if match and match.group(1) in SENSITIVE_VARS:
-            flagged_lines.append((filepath, i + 1, "[Sensitive URL Embedding] " + line.strip()))
-            
+    for i, start, line, match in matching_lines(URL_PATTERN, text, numbered=numbered):
+        if match.group(1) in SENSITIVE_VARS:
+            emit("Sensitive URL Embedding", i, start, line)
+
     # --- SQL Injection Detection ---
-    for i, line in enumerate(lines):
-        if SQL_INJECTION_PATTERN.search(line):
-            flagged_lines.append((filepath, i + 1, "[SQL Injection Risk] " + line.strip()))
-            
+    for i, start, line, _ in matching_lines(SQL_INJECTION_PATTERN, text, folded, ("select",),
+                                            numbered):
+        emit("SQL Injection Risk", i, start, line)
+
     # --- Sensitive Data in Exception Messages ---
-    for i, line in enumerate(lines):
-        if RAISE_SENSITIVE_PATTERN.search(line):
-            flagged_lines.append((filepath, i + 1, "[Sensitive in Exception] " + line.strip()))
-            
+    for i, start, line, _ in matching_lines(RAISE_SENSITIVE_PATTERN, text, folded, ("raise",),
+                                            numbered):
+        emit("Sensitive in Exception", i, start, line)
+
     # --- Local Storage Usage Detection ---
-    for i, line in enumerate(lines):
-        if LOCAL_STORAGE_PATTERN.search(line) and any(var in line for var in SENSITIVE_VARS):
-            flagged_lines.append((filepath, i + 1, "[Local Storage Usage] " + line.strip()))
+    for i, start, line, _ in matching_lines(LOCAL_STORAGE_PATTERN, text, folded, ("storage",),
+                                            numbered):
+        if any(var in line for var in SENSITIVE_VARS):
+            emit("Local Storage Usage", i, start, line)
+
+
+# Interned file paths of the flagged lines; FlaggedLine.path_id indexes PATHS
+PATHS = []
+PATH_IDS = {}
+LINE_BREAK = re.compile(rb"\r\n|\r|\n")
+# Bytes read at a time when reading a snippet back from a file
+SNIPPET_CHUNK_BYTES = 64 * 1024
+# analyze_file with workers splits files of at least two chunks
+CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def intern_path(path):
+    path_id = PATH_IDS.get(path)
+    if path_id is None:
+        path_id = PATH_IDS[path] = len(PATHS)
+        PATHS.append(path)
+    return path_id
+
+
+def line_at(data, offset):
+    m = LINE_BREAK.search(data, offset)
+    return data[offset:m.start() if m else len(data)].decode("utf-8", errors="replace").strip()
+
+
+def read_snippet(path, offset):
+    # The stripped text of the line starting at byte `offset`
+    chunks = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            chunk = f.read(SNIPPET_CHUNK_BYTES)
+            chunks.append(chunk)
+            if not chunk or LINE_BREAK.search(chunk):
+                break
+    return line_at(b"".join(chunks), 0)
+
+
+def read_snippets(flagged_lines):
+    # The snippets of many flagged lines, reading every file once
+    snippets = []
+    path_id = data = None
+    for flagged in flagged_lines:
+        if flagged.path_id != path_id:
+            path_id = flagged.path_id
+            with open(PATHS[path_id], "rb") as f:
+                data = f.read()
+        snippets.append(line_at(data, flagged.offset))
+    return snippets
+
+
+class FlaggedLine:
+    # A scanner hit: ids into PATHS and RULES, the line number and the byte offset of the line.
+    # The line text is only read back from the file when the snippet or message is used.
+    # Iterating gives the (filepath, line number, "[Rule] line") tuple.
+    __slots__ = ("path_id", "rule_id", "line", "offset")
+
+    def __init__(self, path_id, rule_id, line, offset):
+        self.path_id = path_id
+        self.rule_id = rule_id
+        self.line = line
+        self.offset = offset
+
+    @property
+    def path(self):
+        return PATHS[self.path_id]
 
+    @property
+    def rule(self):
+        return RULES[self.rule_id]
+
+    @property
+    def snippet(self):
+        return read_snippet(self.path, self.offset)
+
+    @property
+    def message(self):
+        return "[" + self.rule + "] " + self.snippet
+
+    def __iter__(self):
+        return iter((self.path, self.line, self.message))
+
+    def __getitem__(self, index):
+        if isinstance(index, int) and -3 <= index < 3:
+            if index % 3 == 0:
+                return self.path
+            if index % 3 == 1:
+                return self.line
+            return self.message
+        return (self.path, self.line, self.message)[index]
+
+    def __len__(self):
+        return 3
+
+    def __repr__(self):
+        return f"FlaggedLine({self.path!r}, {self.line}, {self.rule!r}, offset={self.offset})"
+
+
+def decode(data):
+    # The text open(..., "r", encoding="utf-8") reads, with universal newlines
+    text = data.decode("utf-8")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def line_offsets(data):
+    # The byte offsets of the line starts, or None when they are the character offsets
+    if data.isascii() and b"\r" not in data:
+        return None
+    return [0] + [m.end() for m in LINE_BREAK.finditer(data)]
+
+
+def analyze_file(filepath, workers=None):
+    if workers and os.path.getsize(filepath) >= 2 * CHUNK_BYTES:
+        return analyze_file_chunked(filepath, workers)
+    with open(filepath, "rb") as f:
+        data = f.read()
+    text = decode(data)
+
+    path_id = intern_path(filepath)
+    offsets = line_offsets(data)
+    flagged_lines = []
+    detect(text, lambda rule, i, start, line: flagged_lines.append(FlaggedLine(
+        path_id, RULE_INDEX[rule], i + 1, start if offsets is None else offsets[i])))
+    return flagged_lines
+
+
+class ConsentSummary:
+    # What one chunk of a file contributes to consent detection. Lines are chunk-local.
+    # Before its first `if consent:` line the chunk depends on the block state it starts in:
+    # `depends` are the risky lines there and `exits` the (line, indent) of the non-blank lines
+    # indented less than all before them, the only lines that can end an enclosing block.
+    # After the first header the state is known: `outside` are the risky lines outside a
+    # block and `inside`/`level` the state the chunk ends in.
+
+    def __init__(self, first_revoked, depends, exits, header, outside, inside, level):
+        self.first_revoked = first_revoked
+        self.depends = depends
+        self.exits = exits
+        self.header = header
+        self.outside = outside
+        self.inside = inside
+        self.level = level
+
+
+def indentation(line):
+    return len(line) - len(line.lstrip())
+
+
+def summarize_consent(text, folded, offsets):
+    lines = split_lines(text)
+    revoked = next(matching_lines(REVOCATION_PATTERN, text, folded, ("consent",)), None)
+    risky_lines = risky_uses(text, folded)
+    risky = sorted(risky_lines)
+    # The header pattern is case-sensitive, so the text itself is searched for the literal
+    headers = [i for i, _, _, _ in matching_lines(CONSENT_BLOCK_PATTERN, text, text, ("consent",))]
+
+    def offset(i):
+        return risky_lines[i] if offsets is None else offsets[i]
+
+    first_header = headers[0] if headers else len(lines)
+    depends = [(i, offset(i)) for i in risky if i < first_header]
+    exits = []
+    for i in range(first_header):
+        if lines[i].strip() != "":
+            indent = indentation(lines[i])
+            if not exits or indent < exits[-1][1]:
+                exits.append((i, indent))
+                if indent == 0:
+                    break
+
+    # Each header opens a block that lasts until a non-blank line indented no deeper,
+    # or until the next header
+    outside = []
+    inside_consent_block = False
+    indent_level = None
+    for n, header in enumerate(headers):
+        end = headers[n + 1] if n + 1 < len(headers) else len(lines)
+        indent_level = indentation(lines[header])
+        exit_line = next((i for i in range(header + 1, end)
+                          if lines[i].strip() != "" and indentation(lines[i]) <= indent_level),
+                         None)
+        inside_consent_block = exit_line is None
+        if exit_line is not None:
+            outside += [(i, offset(i)) for i in risky[bisect_left(risky, exit_line):
+                                                      bisect_left(risky, end)]]
+
+    return ConsentSummary(revoked[0] if revoked else None, depends, exits, bool(headers),
+                          outside, inside_consent_block, indent_level)
+
+
+def scan_chunk(filepath, start, end):
+    # Runs in a worker: scans bytes [start, end) of a file, which begin and end at line
+    # boundaries. Returns the chunk's line count, its line-local hits per rule as
+    # (line index, byte offset) and its ConsentSummary, all relative to the chunk.
+    with open(filepath, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    text = decode(data)
+    offsets = line_offsets(data)
+    folded = fold(text)
+    hits = [[] for _ in RULES]
+    detect_line_rules(text, lambda rule, i, line_start, line: hits[RULE_INDEX[rule]].append(
+        (i, line_start if offsets is None else offsets[i])), folded)
+    return text.count("\n"), hits, summarize_consent(text, folded, offsets)
+
+
+def chunk_bounds(filepath, chunk_bytes):
+    # Byte ranges of about chunk_bytes each, all but the last ending after a line feed
+    size = os.path.getsize(filepath)
+    bounds = [0]
+    with open(filepath, "rb") as f:
+        pos = chunk_bytes
+        while pos < size:
+            f.seek(pos)
+            newline = -1
+            while newline == -1:
+                block = f.read(64 * 1024)
+                if not block:
+                    break
+                newline = block.find(b"\n")
+                if newline == -1:
+                    pos += len(block)
+            if newline == -1 or pos + newline + 1 >= size:
+                break
+            pos += newline + 1
+            bounds.append(pos)
+            pos += chunk_bytes
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def analyze_file_chunked(filepath, workers=None, chunk_bytes=CHUNK_BYTES):
+    # analyze_file for one large file: the chunks are scanned in parallel and consent state
+    # is carried across them in a sequential merge of their summaries
+    bounds = chunk_bounds(filepath, chunk_bytes)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks = list(executor.map(scan_chunk, [filepath] * len(bounds),
+                                   [start for start, _ in bounds], [end for _, end in bounds]))
+
+    first_lines = []
+    first_line = 0
+    for line_count, _, _ in chunks:
+        first_lines.append(first_line)
+        first_line += line_count
+
+    path_id = intern_path(filepath)
+    flagged_lines = []
+
+    # Consent state carried from chunk to chunk
+    revoked = [first + c.first_revoked for first, (_, _, c) in zip(first_lines, chunks)
+               if c.first_revoked is not None]
+    if revoked:
+        first_revoked = min(revoked)
+        inside_consent_block = False
+        indent_level = None
+        for (start, _), first, (_, _, consent) in zip(bounds, first_lines, chunks):
+            exit_line = None
+            if inside_consent_block:
+                exit_line = next((i for i, indent in consent.exits if indent <= indent_level),
+                                 None)
+            risky = [(i, offset) for i, offset in consent.depends
+                     if not inside_consent_block or (exit_line is not None and i >= exit_line)]
+            for i, offset in risky + consent.outside:
+                if first + i >= first_revoked:
+                    flagged_lines.append(FlaggedLine(path_id, RULE_INDEX["Consent Revoked"],
+                                                     first + i + 1, start + offset))
+            if consent.header:
+                inside_consent_block, indent_level = consent.inside, consent.level
+            elif exit_line is not None:
+                inside_consent_block = False
 
+    for rule_id in range(len(RULES)):
+        for (start, _), first, (_, hits, _) in zip(bounds, first_lines, chunks):
+            for i, offset in hits[rule_id]:
+                flagged_lines.append(FlaggedLine(path_id, rule_id, first + i + 1, start + offset))
     return flagged_lines
 
 
-def scan_directory(directory):
+def scan_directory(directory, baseline=None):
+    # baseline: a FindingBaseline.Baseline whose accepted and suppressed findings are left out
     for filename in os.listdir(directory):
         if filename.endswith(".py"):
             full_path = os.path.join(directory, filename)
             results = analyze_file(full_path)
+            if baseline is not None:
+                results = baseline.filter_results(full_path, results)
             if results:
                 print(f"\n[!] Issues in {filename}:")
-                for file, line_num, message in results:
-                    print(f"  Line {line_num}: {message}")
+                for flagged, snippet in zip(results, read_snippets(results)):
+                    print(f"  Line {flagged.line}: [{flagged.rule}] {snippet}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,187 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from CodeQLDatabaseCache import iter_source_files
+from CodeQLPrepass import SENSITIVE_ANCHOR
+from PythonQueryGeneral import analyze_file, read_snippets
+
+# Risk score weights. A file changed in the working tree or the recent commits counts most,
+# then a name hinting at personal data, the density of sensitive identifiers and the mtime.
+CHANGED_WEIGHT = 4.0
+NAME_WEIGHT = 2.0
+DENSITY_WEIGHT = 2.0
+RECENT_WEIGHT = 1.0
+NAME_HINTS = ("user", "auth", "payment", "account", "login", "password", "profile", "customer",
+              "billing", "email", "session", "token", "card")
+RECENT_COMMITS = 50
+RECENT_DAYS = 30
+# Sensitive identifiers per KB at which the density score is full
+FULL_DENSITY = 5.0
+DENSITY_SAMPLE_BYTES = 4096
+# Share of a time budget that listing and scoring the files may take before scanning starts
+PRIORITIZE_SHARE = 0.25
+
+
+class Coverage:
+
+    def __init__(self):
+        self.total_files = 0
+        self.total_bytes = 0
+        self.scanned_files = 0
+        self.scanned_bytes = 0
+        self.findings = 0
+        self.first_finding = None
+        self.seconds = 0.0
+        self.skipped = []
+        # False when the budget ran out before the whole tree was listed
+        self.listed_all = True
+
+    def __str__(self):
+        lines = [f"Scanned {self.scanned_files} of {self.total_files} files, "
+                 f"{self.scanned_bytes} of {self.total_bytes} bytes "
+                 f"({100 * self.scanned_bytes / max(1, self.total_bytes):.1f}%) "
+                 f"in {self.seconds:.2f}s, {self.findings} findings"]
+        if self.first_finding is not None:
+            lines.append(f"First finding after {self.first_finding:.3f}s")
+        if self.skipped:
+            lines.append(f"Not scanned within the budget ({len(self.skipped)} files), "
+                         f"highest risk first:")
+            skipped = sorted(self.skipped, key=lambda s: (-s[0], s[1]))
+            lines += [f"  {score:5.2f}  {rel_path}" for score, rel_path in skipped[:10]]
+        if not self.listed_all:
+            lines.append("Listing stopped at the budget: the totals only cover the files listed")
+        return "\n".join(lines)
+
+
+def git_lines(root, args, deadline=None):
+    # Output lines of a git command, or none if it fails or does not finish by the deadline
+    timeout = None
+    if deadline is not None:
+        timeout = deadline - time.monotonic()
+        if timeout <= 0:
+            return []
+    try:
+        return subprocess.run(["git", "-C", root] + args, capture_output=True, text=True,
+                              check=True, timeout=timeout).stdout.splitlines()
+    except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired):
+        return []
+
+
+def recently_changed(root, deadline=None):
+    # Paths relative to root that are modified, untracked or changed in the recent commits
+    changed = set(git_lines(root, ["diff", "--name-only", "--relative", "HEAD"], deadline))
+    changed.update(git_lines(root, ["ls-files", "--others", "--exclude-standard"], deadline))
+    changed.update(git_lines(root, ["log", "--name-only", "--relative", "--format=",
+                                    "-n", str(RECENT_COMMITS)], deadline))
+    changed.discard("")
+    return changed
+
+
+def risk_score(rel_path, full_path, stat, changed, now, sample=True):
+    # Without `sample` the density of sensitive identifiers is left out, so the file is not read
+    score = 0.0
+    if rel_path in changed:
+        score += CHANGED_WEIGHT
+    score += RECENT_WEIGHT * max(0.0, 1.0 - (now - stat.st_mtime) / (RECENT_DAYS * 86400))
+    name = rel_path.lower()
+    if any(hint in name for hint in NAME_HINTS):
+        score += NAME_WEIGHT
+    if not sample:
+        return score
+    with open(full_path, "rb") as f:
+        sample = f.read(DENSITY_SAMPLE_BYTES)
+    if sample:
+        density = len(SENSITIVE_ANCHOR.findall(sample)) * 1024 / len(sample)
+        score += DENSITY_WEIGHT * min(1.0, density / FULL_DENSITY)
+    return score
+
+
+def prioritized_files(root, deadline=None):
+    # Returns [(score, rel path, full path, size)] highest risk first, and an iterator of the
+    # same tuples for the files not yet scored when the deadline passed. Those are listed
+    # lazily in walk order and scored without reading them.
+    sources = iter_source_files(root)
+    changed = recently_changed(root, deadline)
+    now = time.time()
+    files = []
+    for rel_path, full_path in sources:
+        if rel_path.endswith(".py"):
+            stat = os.stat(full_path)
+            files.append((risk_score(rel_path, full_path, stat, changed, now), rel_path,
+                          full_path, stat.st_size))
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+    files.sort(key=lambda f: (-f[0], f[1]))
+
+    def remaining():
+        for rel_path, full_path in sources:
+            if rel_path.endswith(".py"):
+                stat = os.stat(full_path)
+                yield (risk_score(rel_path, full_path, stat, changed, now, sample=False),
+                       rel_path, full_path, stat.st_size)
+
+    return files, remaining()
+
+
+def scan_prioritized(root, budget=None, coverage=None):
+    # Yields (rel path, FlaggedLines) of the files with findings, in risk order, until the
+    # budget in seconds is spent. Files that would not finish in the remaining time at the
+    # throughput so far are skipped, so a run stops on time instead of in a large file.
+    # Listing and scoring count against the budget too: after PRIORITIZE_SHARE of it the
+    # scored files are scanned, then the rest of the tree in walk order as it is listed.
+    coverage = coverage if coverage is not None else Coverage()
+    start = time.monotonic()
+    deadline = start + budget if budget is not None else None
+    prioritize_deadline = start + budget * PRIORITIZE_SHARE if budget is not None else None
+    files, rest = prioritized_files(root, prioritize_deadline)
+    coverage.total_files = len(files)
+    coverage.total_bytes = sum(f[3] for f in files)
+    scan_seconds = 0.0
+    for source in (files, rest):
+        for score, rel_path, full_path, size in source:
+            if source is rest:
+                coverage.total_files += 1
+                coverage.total_bytes += size
+            now = time.monotonic()
+            if deadline is not None:
+                remaining = deadline - now
+                rate = coverage.scanned_bytes / scan_seconds if scan_seconds else None
+                if remaining <= 0 or (rate and size / rate > remaining):
+                    coverage.skipped.append((score, rel_path))
+                    if remaining <= 0 and source is rest:
+                        coverage.listed_all = False
+                        break
+                    continue
+            try:
+                flagged_lines = analyze_file(full_path)
+            except UnicodeDecodeError:
+                flagged_lines = []
+            scan_seconds += time.monotonic() - now
+            coverage.scanned_files += 1
+            coverage.scanned_bytes += size
+            if flagged_lines and coverage.first_finding is None:
+                coverage.first_finding = time.monotonic() - start
+            coverage.findings += len(flagged_lines)
+            coverage.seconds = time.monotonic() - start
+            if flagged_lines:
+                yield rel_path, flagged_lines
+    coverage.seconds = time.monotonic() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Scan the highest-risk files first and stop at a time budget.")
+    parser.add_argument("source_root", nargs="?", default="test-code")
+    parser.add_argument("--budget", type=float, help="Seconds (default: no limit)")
+    args = parser.parse_args()
+
+    coverage = Coverage()
+    for rel_path, flagged_lines in scan_prioritized(args.source_root, args.budget, coverage):
+        print(f"\n[!] Issues in {rel_path}:")
+        for flagged, snippet in zip(flagged_lines, read_snippets(flagged_lines)):
+            print(f"  Line {flagged.line}: [{flagged.rule}] {snippet}")
+        sys.stdout.flush()
+    print("\n" + str(coverage), file=sys.stderr)
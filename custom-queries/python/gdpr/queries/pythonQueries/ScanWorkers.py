@@ -0,0 +1,137 @@
+import argparse
+import mmap
+import os
+import pickle
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from CodeQLDatabaseCache import iter_source_files
+from PythonQueryGeneral import FlaggedLine, analyze_file, intern_path
+
+# One finding as it crosses from a worker to the parent: the file's index within its batch,
+# the rule id, the line number and the byte offset of the line. No text is transferred; the
+# parent reads snippets from the files when a reporter needs them.
+RECORD = struct.Struct("<IBIQ")
+BATCH_SIZE = 64
+# Records decoded per step in the parent
+DECODE_RECORDS = 4096
+
+
+class TransferStats:
+
+    def __init__(self):
+        self.files = 0
+        self.findings = 0
+        self.spill_bytes = 0
+        self.pickle_bytes = 0
+
+    @property
+    def ipc_bytes(self):
+        return self.spill_bytes + self.pickle_bytes
+
+    def bytes_per_finding(self):
+        return self.ipc_bytes / max(1, self.findings)
+
+    def __str__(self):
+        return (f"{self.findings} findings in {self.files} files, {self.ipc_bytes} IPC bytes "
+                f"({self.spill_bytes} spilled, {self.pickle_bytes} pickled), "
+                f"{self.bytes_per_finding():.1f} bytes per finding")
+
+
+def scan_batch(spill_path, paths):
+    # Runs in a worker: scans the files and writes their findings to the spill file.
+    # Returns only the record count and the indexes of the files that could not be decoded.
+    records = bytearray()
+    skipped = []
+    for index, path in enumerate(paths):
+        try:
+            flagged_lines = analyze_file(path)
+        except UnicodeDecodeError:
+            skipped.append(index)
+            continue
+        for flagged in flagged_lines:
+            records += RECORD.pack(index, flagged.rule_id, flagged.line, flagged.offset)
+    with open(spill_path, "wb") as f:
+        f.write(records)
+    return len(records) // RECORD.size, skipped
+
+
+def decode_spill(spill_path, paths):
+    # Yields the FlaggedLines of a spill file, unpacking the records in batches
+    path_ids = [intern_path(path) for path in paths]
+    with open(spill_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as spill:
+            step = DECODE_RECORDS * RECORD.size
+            for start in range(0, size, step):
+                chunk = spill[start:start + step]
+                for index, rule_id, line, offset in RECORD.iter_unpack(chunk):
+                    yield FlaggedLine(path_ids[index], rule_id, line, offset)
+
+
+def scan_parallel(source_root, workers=None, batch_size=BATCH_SIZE, stats=None):
+    # Yields the FlaggedLines of all Python files under source_root, in file order
+    stats = stats if stats is not None else TransferStats()
+    paths = [full for rel, full in iter_source_files(source_root) if rel.endswith(".py")]
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    spill_dir = tempfile.mkdtemp(prefix="gdpr-spill-")
+    try:
+        spill_paths = [os.path.join(spill_dir, "batch-%06d.bin" % i) for i in range(len(batches))]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(scan_batch, spill_paths, batches)
+            for spill_path, batch, result in zip(spill_paths, batches, results):
+                count, skipped = result
+                stats.files += len(batch) - len(skipped)
+                stats.findings += count
+                stats.spill_bytes += count * RECORD.size
+                stats.pickle_bytes += (len(pickle.dumps((scan_batch, spill_path, batch)))
+                                       + len(pickle.dumps(result)))
+                yield from decode_spill(spill_path, batch)
+                os.remove(spill_path)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def tuple_pickle_bytes(source_root):
+    # What returning analyze_file's (filepath, line, message) tuples from workers would pickle
+    total = 0
+    findings = 0
+    for rel, full in iter_source_files(source_root):
+        if rel.endswith(".py"):
+            try:
+                results = [tuple(flagged) for flagged in analyze_file(full)]
+            except UnicodeDecodeError:
+                continue
+            total += len(pickle.dumps(results))
+            findings += len(results)
+    return total, findings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the Python scanners in worker processes and measure the result transfer.")
+    parser.add_argument("source_root", nargs="?", default="test-code")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--print", action="store_true", help="Print every finding")
+    parser.add_argument("--compare", action="store_true",
+                        help="Also measure pickling the finding tuples")
+    args = parser.parse_args()
+
+    stats = TransferStats()
+    start = time.perf_counter()
+    for flagged in scan_parallel(args.source_root, args.workers, args.batch_size, stats):
+        if args.print:
+            print(f"{flagged.path}:{flagged.line}: [{flagged.rule}] {flagged.snippet}")
+    seconds = time.perf_counter() - start
+    print(f"{stats} in {seconds:.2f}s", file=sys.stderr)
+    if args.compare:
+        total, findings = tuple_pickle_bytes(args.source_root)
+        print(f"Pickled tuples: {total} bytes, {total / max(1, findings):.1f} bytes per finding",
+              file=sys.stderr)
@@ -0,0 +1,5 @@
+email = "user@example.com"
+
+# Queries
+password = "hunter2"
+cursor.execute("SELECT * FROM users WHERE email = '" + email + "'")